@@ -0,0 +1,262 @@
+"""Index FAISS approchés (HNSW, IVF-Flat, IVF-PQ) construits à côté de l'index exact.
+
+L'index plat de LangChain reste la source de vérité (ajouts, suppressions,
+reconstruction des vecteurs). À chaque sauvegarde, un index approché `ann.faiss`
+est dérivé dans le même instantané avec les mêmes positions, donc la table
+position -> identifiant du docstore reste valable. Les lecteurs remplacent
+l'index plat par l'index approché au chargement.
+
+Rapport rappel / latence contre l'index exact :
+    python ann_index.py --report
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+from index_store import read_vectors
+
+# "auto" (selon la taille du corpus), "flat", "hnsw", "ivf_flat" ou "ivf_pq"
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "auto")
+# Seuils de la sélection automatique (nombre de chunks)
+HNSW_MIN_VECTORS = int(os.getenv("HNSW_MIN_VECTORS", "20000"))
+IVF_MIN_VECTORS = int(os.getenv("IVF_MIN_VECTORS", "200000"))
+IVF_PQ_MIN_VECTORS = int(os.getenv("IVF_PQ_MIN_VECTORS", "2000000"))
+# Paramètres de recherche
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+# Ré-entraînement complet quand le corpus a grossi de ce facteur depuis le dernier entraînement
+RETRAIN_GROWTH = float(os.getenv("ANN_RETRAIN_GROWTH", "2.0"))
+# Vecteurs lus depuis l'index exact par lot lors de la construction (pas de copie complète)
+ANN_ADD_BATCH = int(os.getenv("ANN_ADD_BATCH", "100000"))
+# Taille maximale de l'échantillon d'entraînement (IVF/PQ), sans descendre sous 39 points par centroïde
+ANN_MAX_TRAINING_VECTORS = int(os.getenv("ANN_MAX_TRAINING_VECTORS", "200000"))
+
+ANN_FILE = "ann.faiss"
+ANN_META_FILE = "ann_meta.json"
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+# Points d'entraînement minimaux : 39 par centroïde (k-means FAISS), 256 centroïdes par sous-quantifieur PQ8
+MIN_POINTS_PER_CENTROID = 39
+PQ_CENTROIDS = 256
+MAX_POINTS_PER_CENTROID = 256
+
+def choose_index_type(n_vectors: int, requested: str = FAISS_INDEX_TYPE) -> str:
+    """Type d'index demandé, ou choisi selon la taille du corpus en mode auto"""
+    if requested != "auto":
+        if requested not in INDEX_TYPES:
+            raise ValueError(f"Type d'index FAISS inconnu : {requested}")
+        return requested
+    if n_vectors >= IVF_PQ_MIN_VECTORS:
+        return "ivf_pq"
+    if n_vectors >= IVF_MIN_VECTORS:
+        return "ivf_flat"
+    if n_vectors >= HNSW_MIN_VECTORS:
+        return "hnsw"
+    return "flat"
+
+def usable_index_type(index_type: str, n_vectors: int) -> str:
+    """Type réellement constructible : trop peu de vecteurs pour entraîner IVF/PQ -> HNSW"""
+    if index_type == "ivf_pq":
+        needed = MIN_POINTS_PER_CENTROID * PQ_CENTROIDS
+    elif index_type == "ivf_flat":
+        needed = MIN_POINTS_PER_CENTROID
+    else:
+        return index_type
+    if n_vectors < needed:
+        print(f"⚠️ {n_vectors} vecteurs : trop peu pour entraîner {index_type} (au moins {needed}), index hnsw à la place.")
+        return "hnsw"
+    return index_type
+
+def _nlist(n_vectors: int) -> int:
+    # ~4·sqrt(n) listes, avec au moins 39 points d'entraînement par liste
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+def _pq_subquantizers(dimension: int) -> int:
+    # Plus grand diviseur de la dimension <= 64 (ex. 1536 -> 64, 384 -> 48)
+    return max(m for m in range(1, 65) if dimension % m == 0)
+
+def _new_index(dimension: int, n_vectors: int, index_type: str):
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+    if index_type == "ivf_flat":
+        return faiss.index_factory(dimension, f"IVF{_nlist(n_vectors)},Flat")
+    if index_type == "ivf_pq":
+        return faiss.index_factory(dimension, f"IVF{_nlist(n_vectors)},PQ{_pq_subquantizers(dimension)}")
+    raise ValueError(f"Type d'index FAISS inconnu : {index_type}")
+
+def _training_positions(index, n_vectors: int, seed: int = 0) -> np.ndarray:
+    """Échantillon d'entraînement (k-means n'utilise pas plus de 256 points par centroïde)"""
+    ivf = faiss.try_extract_index_ivf(index)
+    centroids = max(ivf.nlist if ivf is not None else 1, PQ_CENTROIDS)
+    size = min(n_vectors, max(MIN_POINTS_PER_CENTROID * centroids,
+                              min(MAX_POINTS_PER_CENTROID * centroids, ANN_MAX_TRAINING_VECTORS)))
+    if size == n_vectors:
+        return np.arange(n_vectors)
+    return np.sort(np.random.default_rng(seed).choice(n_vectors, size=size, replace=False))
+
+def build_index(vectors: np.ndarray, index_type: str):
+    """Construit (et entraîne si besoin, sur un échantillon) un index FAISS L2 du type demandé"""
+    n_vectors, dimension = vectors.shape
+    index = _new_index(dimension, n_vectors, index_type)
+    if not index.is_trained:
+        index.train(vectors[_training_positions(index, n_vectors)])
+    index.add(vectors)
+    set_search_params(index)
+    return index
+
+def _add_from(index, source, start: int, end: int):
+    """Ajoute les vecteurs [start, end) de l'index exact `source`, par lots"""
+    for batch_start in range(start, end, ANN_ADD_BATCH):
+        index.add(source.reconstruct_n(batch_start, min(ANN_ADD_BATCH, end - batch_start)))
+
+def build_index_from(source, index_type: str):
+    """build_index à partir de l'index exact, sans en copier tous les vecteurs en mémoire"""
+    n_vectors = source.ntotal
+    index = _new_index(source.d, n_vectors, index_type)
+    if not index.is_trained:
+        index.train(source.reconstruct_batch(_training_positions(index, n_vectors).astype(np.int64)))
+    _add_from(index, source, 0, n_vectors)
+    set_search_params(index)
+    return index
+
+def set_search_params(index, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH):
+    """Règle nprobe (IVF) ou efSearch (HNSW) sur un index approché"""
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+
+def _ids_hash(ids: list) -> str:
+    return hashlib.sha256("\0".join(ids).encode("utf-8")).hexdigest()
+
+def _load_meta(snapshot_path: str):
+    if not snapshot_path:
+        return None
+    try:
+        with open(os.path.join(snapshot_path, ANN_META_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def update_ann_index(db, snapshot_path: str, previous_snapshot_path: str = None):
+    """Écrit l'index approché d'un instantané à partir de son index exact.
+
+    Si l'instantané précédent n'a fait qu'ajouter des vecteurs et que le corpus
+    n'a pas trop grossi, on reprend son index approché et on y ajoute les
+    nouveaux vecteurs ; sinon (suppressions, changement de type, croissance
+    forte) on ré-entraîne un index complet.
+    """
+    n_vectors = db.index.ntotal
+    index_type = choose_index_type(n_vectors)
+    if index_type == "flat" or n_vectors == 0:
+        return None
+    index_type = usable_index_type(index_type, n_vectors)
+
+    ids = [db.index_to_docstore_id[i] for i in range(n_vectors)]
+    previous = _load_meta(previous_snapshot_path)
+    append_only = (
+        previous is not None
+        and previous["type"] == index_type
+        and previous["ntotal"] <= n_vectors
+        and previous["ids_hash"] == _ids_hash(ids[:previous["ntotal"]])
+        and n_vectors < RETRAIN_GROWTH * previous["trained_on"]
+    )
+
+    start = time.perf_counter()
+    if append_only:
+        index = faiss.read_index(os.path.join(previous_snapshot_path, ANN_FILE))
+        _add_from(index, db.index, previous["ntotal"], n_vectors)
+        trained_on = previous["trained_on"]
+    else:
+        index = build_index_from(db.index, index_type)
+        trained_on = n_vectors
+        print(f"🏋️ Index {index_type} entraîné sur {n_vectors} vecteurs.")
+
+    faiss.write_index(index, os.path.join(snapshot_path, ANN_FILE))
+    with open(os.path.join(snapshot_path, ANN_META_FILE), "w", encoding="utf-8") as f:
+        json.dump({"type": index_type, "ntotal": n_vectors, "trained_on": trained_on,
+                   "ids_hash": _ids_hash(ids)}, f)
+    print(f"🧭 Index approché {index_type} sauvegardé ({time.perf_counter() - start:.2f}s).")
+    return index_type
+
+def load_ann_index(snapshot_path: str, n_vectors: int):
+    """Charge l'index approché d'un instantané s'il correspond à son index exact"""
+    meta = _load_meta(snapshot_path)
+    if meta is None or meta["ntotal"] != n_vectors:
+        return None
+    index = read_vectors(os.path.join(snapshot_path, ANN_FILE), mmap=True)
+    set_search_params(index)
+    print(f"🧭 Recherche approchée avec l'index {meta['type']}.")
+    return index
+
+def recall_latency_report(vectors: np.ndarray, k: int = 10, n_queries: int = 200, seed: int = 0) -> list:
+    """Compare rappel@k et latence de chaque type d'index à la recherche exacte"""
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    # Requêtes proches mais distinctes des vecteurs indexés
+    queries = vectors[picked] + rng.normal(0, 0.01, size=(len(picked), vectors.shape[1])).astype(np.float32)
+
+    exact = build_index(vectors, "flat")
+    _, truth = exact.search(queries, k)
+
+    rows = []
+    for index_type in INDEX_TYPES:
+        try:
+            start = time.perf_counter()
+            index = build_index(vectors, index_type)
+            build_seconds = time.perf_counter() - start
+        except Exception as e:
+            print(f"⚠️ {index_type} ignoré : {e}")
+            continue
+        latencies = []
+        found = 0
+        for i, query in enumerate(queries):
+            start = time.perf_counter()
+            _, result = index.search(query[None, :], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found += len(set(result[0]) & set(truth[i]))
+        rows.append({
+            "type": index_type,
+            "recall_at_k": found / (len(queries) * k),
+            "latency_ms_p50": float(np.percentile(latencies, 50)),
+            "latency_ms_p95": float(np.percentile(latencies, 95)),
+            "build_seconds": build_seconds,
+            "size_bytes": int(faiss.serialize_index(index).nbytes),
+        })
+    return rows
+
+if __name__ == "__main__":
+    from data_processor import INDEX_DIR, current_index_path
+
+    parser = argparse.ArgumentParser(description="Rapport rappel / latence des index approchés")
+    parser.add_argument("--report", action="store_true", required=True)
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--json", help="Fichier de sortie JSON")
+    args = parser.parse_args()
+
+    _, path = current_index_path(args.index_dir)
+    if path is None:
+        raise SystemExit("❌ Aucun index FAISS trouvé.")
+    flat = faiss.read_index(os.path.join(path, "index.faiss"))
+    rows = recall_latency_report(flat.reconstruct_n(0, flat.ntotal), args.k, args.queries)
+    print(f"{'type':<10}{'rappel@k':>10}{'p50 ms':>10}{'p95 ms':>10}{'build s':>10}{'taille Mo':>11}")
+    for row in rows:
+        print(f"{row['type']:<10}{row['recall_at_k']:>10.3f}{row['latency_ms_p50']:>10.3f}"
+              f"{row['latency_ms_p95']:>10.3f}{row['build_seconds']:>10.2f}{row['size_bytes'] / 1e6:>11.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"n_vectors": flat.ntotal, "k": args.k, "results": rows}, f, indent=2)
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from embeddings import normalize_text
+
+# Similarité cosinus minimale pour considérer deux questions comme identiques
+SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+# Durée de vie d'une réponse en cache (secondes) et nombre maximal d'entrées
+TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+def normalize_question(question: str) -> str:
+    """Clé d'une entrée : question normalisée (casse, espaces, ponctuation finale)"""
+    return normalize_text(question).lower().rstrip(" ?!.")
+
+class SemanticAnswerCache:
+    """Cache de réponses indexé par l'embedding de la question.
+
+    Chaque entrée est liée à la version de l'index FAISS : une réponse calculée
+    sur d'anciens documents n'est jamais servie. Les entrées expirent après
+    `ttl` secondes (sauf les réponses épinglées, ex. FAQ précalculée) et les
+    moins récemment utilisées sont évincées au-delà de `max_entries`.
+    """
+
+    def __init__(self, embeddings, threshold: float = SIMILARITY_THRESHOLD,
+                 ttl: int = TTL_SECONDS, max_entries: int = MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # clé -> (version de l'index, vecteur normalisé, résultat, date d'insertion ou None si épinglée)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, question: str) -> np.ndarray:
+        # Même texte que la recherche vectorielle : sur un cache manqué, celle-ci relit
+        # l'embedding dans le cache d'embeddings au lieu de refaire un appel à l'API
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _evict_expired(self, now: float):
+        expired = [
+            key for key, entry in self._entries.items() if entry[3] is not None and now - entry[3] > self.ttl
+        ]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, question: str, index_version: str):
+        """Retourne le résultat mis en cache (réponse + sources) ou None"""
+        vector = self._embed(question)
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            best_key, best_score = None, self.threshold
+            for key, (version, cached_vector, _, _) in self._entries.items():
+                if version != index_version:
+                    continue
+                score = float(np.dot(vector, cached_vector))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key][2]
+
+    def put(self, question: str, index_version: str, result: dict, pinned: bool = False):
+        vector = self._embed(question)
+        key = (index_version, normalize_question(question))
+        with self._lock:
+            self._entries[key] = (index_version, vector, result, None if pinned else time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -1,19 +1,48 @@
+import time
+# Début de l'exécution du script : mesure des imports et du rendu de chaque rerun
+_rerun_start = time.perf_counter()
+
 import streamlit as st
 import os
 import base64
-import shutil
+import html
 
 try:
-    from data_processor import process_document, get_vector_store, DOCS_DIR
-    from chatbot import create_chatbot_chain, custom_qa_chain
+    from data_processor import EmbeddingModelMismatchError, process_document, get_vector_store
+    from chatbot import create_chatbot_chain, custom_qa_chain, stream_qa_chain, new_conversation_memory
+    from embeddings import embedding_cache_stats
+    from tracing import Trace, last_trace, start_metrics_server
+    from job_queue import JOB_INGEST, JOB_REMOVE, JOB_RESET, enqueue, list_jobs
+    from worker import ensure_worker_running
+    from course_collections import DEFAULT_COLLECTION, collection_paths, create_collection, list_collections
+    from batch_qa import FAQ_ANSWERS_PATH, warm_answer_cache
 except ImportError:
     st.error("Les fichiers 'data_processor.py' ou 'chatbot.py' sont manquants ou contiennent des erreurs.")
     st.info("Veuillez vous assurer qu'ils sont présents dans le même répertoire que votre script principal.")
     def process_document(path): st.info(f"Traitement fictif de {path}")
     def get_vector_store(): return None
-    DOCS_DIR = "uploaded_docs"
-    def create_chatbot_chain(): return None
+    class EmbeddingModelMismatchError(ValueError): pass
+    DEFAULT_COLLECTION = "general"
+    def collection_paths(name): return "uploaded_docs", "faiss_index"
+    def create_collection(name): return name
+    def list_collections(): return [DEFAULT_COLLECTION]
+    def create_chatbot_chain(collections=None): return None
     def custom_qa_chain(prompt, history): return {"answer": f"Réponse fictive à : {prompt}"}
+    def stream_qa_chain(prompt, history, memory=None, collections=None): return [], iter([f"Réponse fictive à : {prompt}"])
+    def new_conversation_memory(): return None
+    def embedding_cache_stats(): return {"hits": 0, "misses": 0, "hit_rate": 0.0}
+    def last_trace(): return None
+    def start_metrics_server(): pass
+    Trace = None
+    JOB_INGEST, JOB_REMOVE, JOB_RESET = "ingest", "remove", "reset"
+    def enqueue(kind, paths, index_dir): st.info(f"Traitement fictif de {len(paths)} fichier(s)")
+    def list_jobs(limit=10, active_only=False): return []
+    def ensure_worker_running(): pass
+    FAQ_ANSWERS_PATH = None
+    def warm_answer_cache(path=None): return 0
+
+# Durée des imports (réelle au premier chargement, quasi nulle aux reruns suivants)
+_import_seconds = time.perf_counter() - _rerun_start
 
 # Set page configuration
 st.set_page_config(
@@ -23,7 +52,7 @@ st.set_page_config(
 )
 
 # CSS for improved styling
-st.markdown("""
+APP_CSS = """
     <style>
         /* Animation keyframes */
         @keyframes fadeSlide {
@@ -196,16 +225,50 @@ st.markdown("""
             }
         }
     </style>
-""", unsafe_allow_html=True)
+"""
+
+LOGO_PATH = os.path.join("images", "logo_schoolify-removebg-preview.png")
+
+@st.cache_resource
+def load_logo_base64(path: str) -> str:
+    """Logo encodé une seule fois par process"""
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode()
+
+@st.cache_resource
+def build_css(logo_path: str) -> str:
+    """CSS de la page ; le logo y est inclus une fois au lieu de l'être dans chaque message"""
+    logo_rules = (
+        f".chatbot-icon, .title-inline-logo {{ display: inline-block; flex-shrink: 0; "
+        f"background: url('data:image/png;base64,{load_logo_base64(logo_path)}') center / contain no-repeat; }}\n"
+        "        .title-inline-logo { width: 1.9em; vertical-align: middle; }"
+    )
+    return APP_CSS.replace("</style>", f"    {logo_rules}\n    </style>")
+
+@st.cache_resource
+def startup_stats() -> dict:
+    """Durées mesurées au premier chargement du script dans ce process"""
+    return {}
+
+def message_html(role: str, content: str, aria_label: str = None) -> str:
+    """HTML d'une bulle de chat (contenu échappé, icône du chatbot via le CSS)"""
+    content = html.escape(content, quote=False)
+    if role == "user":
+        return (f'<div class="chat-message user" role="log" aria-label="{aria_label or "Message utilisateur"}">'
+                f'<span class="user-icon">👤</span><span>{content}</span></div>')
+    return (f'<div class="chat-message assistant" role="log" aria-label="{aria_label or "Réponse du chatbot"}">'
+            f'<span class="chatbot-icon" role="img" aria-label="Chatbot Icon"></span><span>{content}</span></div>')
+
+# Messages de l'historique : rendus une fois, réutilisés à chaque rerun
+cached_message_html = st.cache_data(max_entries=1000, show_spinner=False)(message_html)
 
 # Load logo
-logo_path = os.path.join("images", "logo_schoolify-removebg-preview.png")
-if not os.path.exists(logo_path):
-    st.error(f"Erreur : Le fichier logo n'a pas été trouvé à l'emplacement : {logo_path}")
+if not os.path.exists(LOGO_PATH):
+    st.error(f"Erreur : Le fichier logo n'a pas été trouvé à l'emplacement : {LOGO_PATH}")
     st.stop()
 
-with open(logo_path, "rb") as f:
-    logo_base64 = base64.b64encode(f.read()).decode()
+st.markdown(build_css(LOGO_PATH), unsafe_allow_html=True)
+startup_stats().setdefault("import_ms", round(_import_seconds * 1000, 1))
 
 # Banner
 with st.container():
@@ -214,7 +277,7 @@ with st.container():
         <div class="banner-container" role="banner">
             <h1 class="banner-title" aria-label="Schoolify Chatbot RAG">
                 Schoolify Chatbot RAG
-                <img class="title-inline-logo" src="data:image/png;base64,{logo_base64}" alt="Schoolify Logo">
+                <span class="title-inline-logo" role="img" aria-label="Schoolify Logo"></span>
             </h1>
             <p class="banner-sub">📚 Ton assistant pédagogique intelligent</p>
         </div>
@@ -222,17 +285,54 @@ with st.container():
         unsafe_allow_html=True
     )
 
+# Endpoint /metrics si METRICS_PORT est défini (démarré une seule fois par process)
+start_metrics_server()
+
+@st.cache_resource(show_spinner=False)
+def warm_faq_answers(path: str) -> int:
+    """Réponses précalculées (batch_qa.py) chargées une seule fois par process"""
+    try:
+        return warm_answer_cache(path)
+    except EmbeddingModelMismatchError as e:
+        print(f"⚠️ FAQ précalculée non chargée : {e}")
+        return 0
+
+if FAQ_ANSWERS_PATH:
+    warm_faq_answers(FAQ_ANSWERS_PATH)
+
 # Initialize session state
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
-if 'qa_chain' not in st.session_state:
-    st.session_state.qa_chain = create_chatbot_chain() if os.path.exists("faiss_index") else None
+if 'memory' not in st.session_state:
+    st.session_state.memory = new_conversation_memory()
 
 # Sidebar
 with st.sidebar:
     st.header("📂 Gestion des documents", anchor=False)
     st.info("Changez le thème clair/sombre via les paramètres Streamlit (⚙️ en haut à droite).")
 
+    # Chaque collection (cours, classe, utilisateur) a ses documents et son index
+    collections = list_collections()
+    if "created_collection" in st.session_state:
+        st.session_state.active_collection = st.session_state.pop("created_collection")
+    active_collection = st.selectbox(
+        "📚 Collection", collections, key="active_collection",
+        help="Collection dans laquelle les documents sont ajoutés ou retirés"
+    )
+    with st.expander("➕ Nouvelle collection"):
+        new_collection = st.text_input("Nom du cours, de la classe...", key="new_collection_name")
+        if st.button("Créer", key="create_collection") and new_collection.strip():
+            try:
+                st.session_state.created_collection = create_collection(new_collection)
+                st.rerun()
+            except ValueError as e:
+                st.error(str(e))
+    search_collections = st.multiselect(
+        "🔎 Rechercher dans", collections, default=[active_collection], key="search_collections",
+        help="Les questions ne cherchent que dans ces collections"
+    )
+    docs_dir, index_dir = collection_paths(active_collection)
+
     with st.container():
         uploaded_files = st.file_uploader(
             "Déposez vos fichiers ici",
@@ -241,85 +341,127 @@ with st.sidebar:
             help="Formats supportés : PDF, TXT, MD, DOCX, CSV, PNG, JPG, JPEG"
         )
 
+        # L'indexation tourne dans worker.py : le chat continue de répondre sur le dernier index validé
         if uploaded_files and st.button("🚀 Traiter les documents", key="process_docs"):
-            with st.spinner("Traitement en cours..."):
-                os.makedirs(DOCS_DIR, exist_ok=True)
-                for uploaded_file in uploaded_files:
-                    path = os.path.join(DOCS_DIR, uploaded_file.name)
-                    with open(path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    process_document(path)
-                st.success("✅ Documents traités avec succès.")
-                st.session_state.qa_chain = create_chatbot_chain()
-                st.rerun()
+            os.makedirs(docs_dir, exist_ok=True)
+            paths = []
+            for uploaded_file in uploaded_files:
+                path = os.path.join(docs_dir, uploaded_file.name)
+                with open(path, "wb") as f:
+                    f.write(uploaded_file.getbuffer())
+                paths.append(path)
+            enqueue(JOB_INGEST, paths, index_dir)
+            ensure_worker_running()
+            st.success("📥 Documents ajoutés à la file d'indexation.")
+            st.rerun()
 
-        if st.button("🧹 Réinitialiser documents", key="reset_docs"):
-            if os.path.exists(DOCS_DIR):
-                for file in os.listdir(DOCS_DIR):
-                    os.remove(os.path.join(DOCS_DIR, file))
-                if not os.listdir(DOCS_DIR):
-                    os.rmdir(DOCS_DIR)
-            if os.path.exists("faiss_index"):
-                shutil.rmtree("faiss_index")
-            st.session_state.qa_chain = None
+        if st.button("🧹 Réinitialiser la collection", key="reset_docs"):
+            if os.path.exists(docs_dir):
+                for file in os.listdir(docs_dir):
+                    os.remove(os.path.join(docs_dir, file))
+                if not os.listdir(docs_dir):
+                    os.rmdir(docs_dir)
+            enqueue(JOB_RESET, [], index_dir)
+            ensure_worker_running()
             st.session_state.chat_history = []
+            st.session_state.memory = new_conversation_memory()
             st.success("✅ Documents et historique réinitialisés.")
             st.rerun()
 
         if st.button("🆕 Nouveau Chat", key="new_chat"):
             st.session_state.chat_history = []
+            st.session_state.memory = new_conversation_memory()
             st.success("✅ Nouvelle conversation démarrée.")
             st.rerun()
 
+    @st.fragment(run_every=2)
+    def show_indexing_jobs():
+        """Avancement des travaux d'indexation, rafraîchi sans relancer tout le script"""
+        for job in list_jobs(limit=5, active_only=True):
+            total = len(job["files"]) or 1
+            label = "⏳ En attente" if job["status"] == "queued" else "🚧 Indexation"
+            st.progress(job["done"] / total, text=f"{label} #{job['id']} — {job['done']}/{len(job['files'])} fichier(s)")
+            for f in job["files"]:
+                icon = {"done": "✅", "failed": "❌", "parsed": "🧩"}.get(f["status"], "⏳")
+                detail = f" ({f['n_chunks']} chunks)" if f["n_chunks"] else ""
+                st.caption(f"{icon} {os.path.basename(f['path'])}{detail}")
+        for job in list_jobs(limit=1):
+            if job["status"] == "failed":
+                st.error(f"Travail #{job['id']} en échec : {job['error']}")
+            elif job["status"] == "partial":
+                st.warning(f"Travail #{job['id']} terminé : {job['error']}")
+
+    show_indexing_jobs()
+
+    debug_mode = st.toggle("🐞 Mode debug", key="debug_mode", help="Affiche la durée de chaque étape du dernier tour")
+    if debug_mode:
+        st.caption(
+            f"⏱️ Imports au démarrage : {startup_stats().get('import_ms', 0)} ms — "
+            f"rerun précédent : {st.session_state.get('last_render_ms', 0)} ms"
+        )
+
     st.markdown("---")
     st.subheader("📄 Documents chargés", anchor=False)
-    docs = os.listdir(DOCS_DIR) if os.path.exists(DOCS_DIR) else []
+    docs = os.listdir(docs_dir) if os.path.exists(docs_dir) else []
     if docs:
         for d in docs:
-            st.markdown(f"✅ {d}")
+            name_col, remove_col = st.columns([5, 1])
+            name_col.markdown(f"✅ {d}")
+            if remove_col.button("🗑️", key=f"remove_{d}", help=f"Retirer {d} de l'index"):
+                enqueue(JOB_REMOVE, [os.path.join(docs_dir, d)], index_dir)
+                ensure_worker_running()
+                st.rerun()
     else:
         st.markdown("_Aucun document actuellement._")
 
+    cache_stats = embedding_cache_stats()
+    if cache_stats["hits"] or cache_stats["misses"]:
+        st.caption(
+            f"💰 Cache d'embeddings : {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['hit_rate']:.0%})"
+        )
+
 # Chat history display
 with st.container():
     for msg in st.session_state.chat_history:
-        role_class = "user" if msg["role"] == "user" else "assistant"
-        content = msg["content"].replace("<", "<").replace(">", ">")  
-        if msg["role"] == "user":
-            st.markdown(
-                f'<div class="chat-message {role_class}" role="log" aria-label="Message utilisateur"><span class="user-icon">👤</span><span>{content}</span></div>',
-                unsafe_allow_html=True
-            )
-        else:
-            st.markdown(
-                f'<div class="chat-message {role_class}" role="log" aria-label="Réponse du chatbot"><img src="data:image/png;base64,{logo_base64}" class="chatbot-icon" alt="Chatbot Icon"><span>{content}</span></div>',
-                unsafe_allow_html=True
-            )
+        st.markdown(cached_message_html(msg["role"], msg["content"]), unsafe_allow_html=True)
 
 # Chat input
 if prompt := st.chat_input("Pose ta question ici...", key="chat_input"):
     st.session_state.chat_history.append({"role": "user", "content": prompt})
-    st.markdown(
-        f'<div class="chat-message user" role="log" aria-label="Message utilisateur"><span class="user-icon">👤</span><span>{prompt.replace("<", "<").replace(">", ">")}</span></div>',
-        unsafe_allow_html=True
-    )
+    st.markdown(cached_message_html("user", prompt), unsafe_allow_html=True)
 
-    if st.session_state.qa_chain:
+    # Pipeline partagée par toutes les sessions, reconstruite seulement si l'index change
+    try:
+        pipeline = create_chatbot_chain(search_collections)
+    except EmbeddingModelMismatchError as e:
+        # Index construit avec un autre modèle d'embeddings : on refuse de le charger
+        st.error(f"❌ Index incompatible : {e}")
+        st.stop()
+    if pipeline:
         with st.spinner("🤖 Réflexion en cours..."):
             try:
-                result = custom_qa_chain(prompt, st.session_state.chat_history)
-                answer = result["answer"]
-                print(f"Raw answer: {answer}")
+                source_docs, tokens = stream_qa_chain(
+                    prompt, st.session_state.chat_history, st.session_state.memory,
+                    collections=search_collections
+                )
+                answer_placeholder = st.empty()
+                answer = ""
+                for token in tokens:
+                    answer += token
+                    # Réponse partielle : pas de cache, elle change à chaque token
+                    answer_placeholder.markdown(message_html("assistant", answer + "▌"), unsafe_allow_html=True)
                 answer = answer.replace("# ", "") if answer.startswith("# ") else answer
                 if prompt.lower() in answer.lower():
                     answer = answer.replace(prompt, "").strip()
                 st.session_state.chat_history.append({"role": "assistant", "content": answer})
-                st.markdown(
-                    f'<div class="chat-message assistant" role="log" aria-label="Réponse du chatbot"><img src="data:image/png;base64,{logo_base64}" class="chatbot-icon" alt="Chatbot Icon"><span>{answer.replace("<", "<").replace(">", ">")}</span></div>',
-                    unsafe_allow_html=True
-                )
+                answer_placeholder.markdown(cached_message_html("assistant", answer), unsafe_allow_html=True)
+
+                turn_trace = last_trace()
+                if debug_mode and turn_trace is not None:
+                    with st.sidebar.expander("🐞 Dernier tour", expanded=True):
+                        st.json(turn_trace.to_dict())
 
-                source_docs = result.get("source_documents", [])
                 if source_docs:
                     with st.sidebar:
                         st.markdown("---")
@@ -327,22 +469,27 @@ if prompt := st.chat_input("Pose ta question ici...", key="chat_input"):
                         for i, doc in enumerate(source_docs):
                             src = doc.metadata.get('source', 'Document inconnu')
                             page = doc.metadata.get('page', 'N/A')
-                            st.markdown(f"**{i+1}. {os.path.basename(src)}** (Page: {page})")
+                            collection = doc.metadata.get('collection')
+                            collection_label = f" — {collection}" if collection else ""
+                            st.markdown(f"**{i+1}. {os.path.basename(src)}** (Page: {page}){collection_label}")
                             with st.expander(f"Extrait document {i+1}"):
                                 excerpt = doc.page_content[:500]
                                 st.markdown(f"{excerpt}...")
             except Exception as e:
                 error_message = "❌ Erreur lors du traitement. Veuillez réessayer ou charger d'autres documents."
                 st.session_state.chat_history.append({"role": "assistant", "content": error_message})
-                st.markdown(
-                    f'<div class="chat-message assistant" role="log" aria-label="Erreur du chatbot"><img src="data:image/png;base64,{logo_base64}" class="chatbot-icon" alt="Chatbot Icon"><span>{error_message}</span></div>',
-                    unsafe_allow_html=True
-                )
+                st.markdown(message_html("assistant", error_message, "Erreur du chatbot"), unsafe_allow_html=True)
                 st.error(f"Une erreur est survenue : {e}")
     else:
         warning_message = "📄 Veuillez d'abord charger et traiter des documents pour démarrer la conversation."
         st.session_state.chat_history.append({"role": "assistant", "content": warning_message})
-        st.markdown(
-            f'<div class="chat-message assistant" role="log" aria-label="Avertissement du chatbot"><img src="data:image/png;base64,{logo_base64}" class="chatbot-icon" alt="Chatbot Icon"><span>{warning_message}</span></div>',
-            unsafe_allow_html=True
-        )
\ No newline at end of file
+        st.markdown(message_html("assistant", warning_message, "Avertissement du chatbot"), unsafe_allow_html=True)
+
+# Coût du rerun : durée des imports et du rendu, journalisée et exportée comme les autres traces
+if Trace is not None:
+    rerun_trace = Trace("app_rerun", start=_rerun_start)
+    rerun_trace.add_stage("imports", _import_seconds)
+    rerun_trace.add_stage("render", time.perf_counter() - _rerun_start - _import_seconds)
+    rerun_trace.set("messages", len(st.session_state.chat_history))
+    rerun_trace.finish()
+    st.session_state.last_render_ms = rerun_trace.to_dict()["total_ms"]
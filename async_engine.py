@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+
+import openai
+
+from chatbot import ANSWER_MODEL, CONDENSE_MODEL, acustom_qa_chain, build_condense_chain
+from data_processor import INDEX_DIR, ingest_files
+from openai_clients import chat_model
+
+# Nombre maximal d'appels simultanés vers l'API pour tout le process
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "8"))
+# Nouvelles tentatives avec backoff exponentiel sur les erreurs transitoires
+ENGINE_MAX_RETRIES = int(os.getenv("ENGINE_MAX_RETRIES", "3"))
+ENGINE_BACKOFF_SECONDS = float(os.getenv("ENGINE_BACKOFF_SECONDS", "0.5"))
+
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+def _request_key(question: str, chat_history: list, collections: list = None) -> str:
+    digest = hashlib.sha256(question.strip().lower().encode("utf-8"))
+    digest.update("\0".join(sorted(collections or [])).encode("utf-8"))
+    for msg in chat_history:
+        digest.update(f"\0{msg['role']}\0{msg['content']}".encode("utf-8"))
+    return digest.hexdigest()
+
+class AsyncQAEngine:
+    """Couche de service asynchrone autour de la pipeline RAG et de l'ingestion.
+
+    Une boucle asyncio tourne dans un thread dédié : le code synchrone (scripts,
+    batch_qa.py) y soumet ses requêtes via `ask` ou `submit`. Seuls les appels
+    au LLM passent par le sémaphore et les retries avec backoff ; leurs clients
+    n'ont pas de retries propres (pas de retries empilés). Deux questions
+    identiques en cours (même historique) ne font qu'un seul appel.
+    L'application Streamlit, qui diffuse la réponse en streaming, n'utilise pas ce moteur.
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+                 max_retries: int = ENGINE_MAX_RETRIES, backoff: float = ENGINE_BACKOFF_SECONDS):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._ingest_lock = asyncio.Lock()
+        self._in_flight = {}
+        self._thread = threading.Thread(target=self._loop.run_forever, name="qa-engine", daemon=True)
+        self._thread.start()
+        # Clients sans retries internes : les retries sont ceux de _with_retry
+        self._llm = chat_model(ANSWER_MODEL, temperature=0.5, max_retries=0)
+        self._condense_chain = build_condense_chain(chat_model(CONDENSE_MODEL, temperature=0, max_retries=0))
+
+    async def _with_retry(self, func, *args):
+        """Un appel réseau, limité par le sémaphore et relancé sur les erreurs transitoires"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    return await func(*args)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                print(f"🔁 Erreur transitoire ({type(e).__name__}), nouvel essai dans {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def aask(self, question: str, chat_history: list, memory=None, collections: list = None) -> dict:
+        """Répond à une question ; les requêtes identiques en cours sont regroupées"""
+        key = _request_key(question, chat_history, collections)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(acustom_qa_chain(
+                question, list(chat_history), memory, collections,
+                generate=lambda messages: self._with_retry(self._llm.ainvoke, messages),
+                condense=lambda inputs: self._with_retry(self._condense_chain.ainvoke, inputs),
+            ))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            print(f"🔗 Requête identique déjà en cours, regroupée : {question}")
+        return await asyncio.shield(task)
+
+    async def agenerate(self, messages: list):
+        """Génération seule sur un prompt déjà construit (mode hors ligne), mêmes limites et retries"""
+        return await self._with_retry(self._llm.ainvoke, messages)
+
+    async def aingest(self, file_paths: list, progress_callback=None, index_dir: str = INDEX_DIR):
+        """Ingestion hors de la boucle (parsing CPU), une seule à la fois par process"""
+        async with self._ingest_lock:
+            return await asyncio.to_thread(ingest_files, file_paths, progress_callback, index_dir=index_dir)
+
+    def submit(self, coro):
+        """Planifie une coroutine sur la boucle du moteur, retourne un concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def ask(self, question: str, chat_history: list, memory=None, timeout: float = None,
+            collections: list = None) -> dict:
+        """Version bloquante de aask, utilisable depuis un script Streamlit"""
+        return self.submit(self.aask(question, chat_history, memory, collections)).result(timeout)
+
+    def ingest(self, file_paths: list, progress_callback=None, index_dir: str = INDEX_DIR):
+        return self.submit(self.aingest(file_paths, progress_callback, index_dir)).result()
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine() -> AsyncQAEngine:
+    """Retourne le moteur partagé du process"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AsyncQAEngine()
+    return _engine
@@ -0,0 +1,158 @@
+"""Réponses hors ligne à une liste de questions (FAQ, révisions avant un examen).
+
+    python batch_qa.py questions.txt --output faq.jsonl
+    python batch_qa.py questions.jsonl --output faq.jsonl --collections reseaux-l2 --concurrency 8
+
+Questions : une par ligne (.txt) ou une ligne JSON {"question": ...} (.jsonl).
+Le fichier de sortie sert de point de reprise : relancer la même commande ne
+traite que les questions sans réponse pour la version actuelle de l'index.
+Avec FAQ_ANSWERS_PATH=faq.jsonl, l'application charge ces réponses dans son
+cache sémantique au démarrage.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import as_completed
+
+# Réponses précalculées chargées dans le cache sémantique de l'application
+FAQ_ANSWERS_PATH = os.getenv("FAQ_ANSWERS_PATH")
+# Questions traitées par lot : une recherche FAISS matricielle par lot, puis point de reprise
+BATCH_QA_CHUNK_SIZE = int(os.getenv("BATCH_QA_CHUNK_SIZE", "256"))
+BATCH_QA_CONCURRENCY = int(os.getenv("BATCH_QA_CONCURRENCY", "8"))
+
+def load_questions(path: str) -> list:
+    """Questions d'un fichier texte ou JSONL, sans doublons, dans l'ordre"""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            questions.append(json.loads(line)["question"] if path.endswith(".jsonl") else line)
+    return list(dict.fromkeys(q.strip() for q in questions if q.strip()))
+
+def load_answers(path: str) -> list:
+    """Réponses déjà écrites ; une dernière ligne tronquée (arrêt brutal) est ignorée"""
+    if not path or not os.path.exists(path):
+        return []
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"⚠️ Ligne illisible ignorée dans {path} : {line[:60]!r}")
+    return records
+
+def _drop_partial_line(path: str):
+    """Coupe une dernière ligne incomplète pour que la reprise écrive sur une ligne neuve"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        if not data or data.endswith(b"\n"):
+            return
+        start = data.rfind(b"\n") + 1
+        try:
+            json.loads(data[start:])
+        except ValueError:
+            f.truncate(start)
+            print(f"♻️ Dernière ligne incomplète retirée de {path}.")
+        else:
+            f.write(b"\n")
+
+def run_batch(questions: list, output_path: str, collections: list = None,
+              concurrency: int = BATCH_QA_CONCURRENCY, chunk_size: int = BATCH_QA_CHUNK_SIZE) -> dict:
+    """Répond à toutes les questions et ajoute chaque réponse au fichier JSONL dès qu'elle est prête"""
+    from async_engine import AsyncQAEngine
+    from chatbot import get_pipeline
+    from retrieval import batch_retrieve
+    from tracing import stage, trace
+
+    pipeline = get_pipeline(collections)
+    if pipeline is None:
+        raise SystemExit("❌ Aucun index pour ces collections : ingérez des documents d'abord.")
+    _drop_partial_line(output_path)
+    done = {record["question"] for record in load_answers(output_path) if record["index_version"] == pipeline.version}
+    todo = [question for question in questions if question not in done]
+    print(f"📋 {len(questions)} question(s), {len(done)} déjà traitée(s), {len(todo)} à traiter.")
+
+    engine = AsyncQAEngine(max_concurrency=concurrency)
+    stats = {"answered": 0, "failed": 0, "skipped": len(questions) - len(todo)}
+    start = time.perf_counter()
+    with trace("batch_qa") as current, open(output_path, "a", encoding="utf-8") as out:
+        current.set("questions", len(todo))
+        for offset in range(0, len(todo), chunk_size):
+            batch = todo[offset:offset + chunk_size]
+            with stage("retrieval"):
+                contexts = batch_retrieve(pipeline.stores, batch)
+            futures = {
+                engine.submit(engine.agenerate(pipeline.build_messages(question, documents))): (question, documents)
+                for question, documents in zip(batch, contexts)
+            }
+            for future in as_completed(futures):
+                question, documents = futures[future]
+                try:
+                    response = future.result()
+                except Exception as e:
+                    print(f"❌ Échec pour « {question} » : {e}")
+                    stats["failed"] += 1
+                    continue
+                record = {
+                    "question": question,
+                    "answer": response.content,
+                    "sources": [{"content": doc.page_content, "metadata": doc.metadata} for doc in documents],
+                    "collections": sorted(pipeline.stores),
+                    "index_version": pipeline.version,
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                }
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                # Point de reprise : une réponse écrite n'est jamais recalculée
+                out.flush()
+                stats["answered"] += 1
+            print(f"✅ {min(offset + chunk_size, len(todo))}/{len(todo)} question(s) traitée(s)")
+        current.set("failed", stats["failed"])
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    return stats
+
+def warm_answer_cache(path: str = FAQ_ANSWERS_PATH) -> int:
+    """Charge les réponses précalculées encore valides (même version d'index) dans le cache sémantique"""
+    from langchain.schema.document import Document
+
+    from chatbot import ANSWER_CACHE_ENABLED, answer_cache, get_pipeline
+
+    if not ANSWER_CACHE_ENABLED:
+        return 0
+    loaded, stale = 0, 0
+    versions = {}
+    for record in load_answers(path):
+        names = tuple(record["collections"])
+        if names not in versions:
+            pipeline = get_pipeline(list(names))
+            versions[names] = pipeline.version if pipeline else None
+        if versions[names] != record["index_version"]:
+            stale += 1
+            continue
+        answer_cache.put(record["question"], record["index_version"], {
+            "answer": record["answer"],
+            "source_documents": [Document(page_content=s["content"], metadata=s["metadata"]) for s in record["sources"]],
+        }, pinned=True)
+        loaded += 1
+    if loaded or stale:
+        print(f"♻️ FAQ précalculée : {loaded} réponse(s) chargée(s), {stale} obsolète(s) ignorée(s).")
+    return loaded
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Réponses hors ligne à une liste de questions")
+    parser.add_argument("questions", help="Fichier de questions (.txt, une par ligne, ou .jsonl)")
+    parser.add_argument("--output", required=True, help="Fichier JSONL des réponses (et point de reprise)")
+    parser.add_argument("--collections", nargs="*", help="Collections interrogées (défaut : collection générale)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_QA_CONCURRENCY, help="Générations simultanées")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_QA_CHUNK_SIZE, help="Questions par recherche groupée")
+    args = parser.parse_args()
+
+    result = run_batch(load_questions(args.questions), args.output, args.collections, args.concurrency, args.chunk_size)
+    print(f"📊 {json.dumps(result, ensure_ascii=False)}")
@@ -0,0 +1,178 @@
+"""Benchmark hors ligne de l'ingestion, de la recherche et de la pipeline complète.
+
+Le LLM et les embeddings sont remplacés par des versions déterministes sans
+réseau (LLM_BACKEND=fake, EMBEDDING_BACKEND=hashing) et tout est écrit dans un
+dossier temporaire. Le résultat est un JSON comparable d'une exécution à l'autre :
+
+    python benchmark.py --docs 40 --pages 5 --output bench.json
+    python benchmark.py --corpus fixtures/ --questions fixtures/questions.jsonl
+
+Format de --questions : une ligne JSON par question, {"question": ..., "source": nom du fichier}.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+WORKDIR = tempfile.mkdtemp(prefix="schoolify-bench-")
+# Doit précéder l'import des modules du projet (configuration lue à l'import)
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "0")
+os.environ["INDEX_DIR"] = os.path.join(WORKDIR, "faiss_index")
+os.environ["CACHE_DIR"] = os.path.join(WORKDIR, "cache")
+
+import numpy as np
+
+_VOCABULARY = (
+    "réseau adresse routeur paquet couche protocole serveur client trame commutateur masque "
+    "passerelle port service requête réponse câble interface configuration sécurité pare-feu "
+    "données transmission débit latence segment session application physique liaison transport"
+).split()
+
+def _fake_term(rng: random.Random) -> str:
+    return "".join(rng.choice("bcdfgklmnprstvz") + rng.choice("aeiou") for _ in range(4)).upper()
+
+def generate_corpus(directory: str, n_docs: int, pages: int, seed: int = 0) -> list:
+    """Crée des PDF synthétiques ; chaque page définit un terme unique. Retourne les questions"""
+    import fitz
+
+    rng = random.Random(seed)
+    questions = []
+    for doc_index in range(n_docs):
+        path = os.path.join(directory, f"cours_{doc_index:03d}.pdf")
+        pdf = fitz.open()
+        for page_index in range(pages):
+            term = _fake_term(rng)
+            filler = " ".join(rng.choice(_VOCABULARY) for _ in range(350))
+            text = f"Le protocole {term} permet de gérer {rng.choice(_VOCABULARY)}. {filler}"
+            page = pdf.new_page()
+            page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=8)
+            questions.append({"question": f"C'est quoi {term} ?", "source": os.path.basename(path),
+                              "page": page_index})
+        pdf.save(path)
+        pdf.close()
+    return questions
+
+def _percentiles(samples_ms: list) -> dict:
+    return {f"p{p}": float(np.percentile(samples_ms, p)) for p in (50, 95, 99)} if samples_ms else {}
+
+def _is_relevant(doc, expected: dict) -> bool:
+    if os.path.basename(doc.metadata.get("source", "")) != expected["source"]:
+        return False
+    return "page" not in expected or doc.metadata.get("page") == expected["page"]
+
+def run(file_paths: list, questions: list, k: int, repeat: int) -> dict:
+    # Imports du chemin de chat (sans loaders ni OCR, importés à la première ingestion)
+    start = time.perf_counter()
+    import chatbot
+    import data_processor
+    from embeddings import embedding_cache_stats
+    from tracing import last_trace
+    import_seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    results = {"n_files": len(file_paths), "n_questions": len(questions), "k": k, "import_seconds": import_seconds}
+
+    # Ingestion : pages et chunks traités par seconde (pages comptées par l'ingestion, fichiers lus une fois)
+    start = time.perf_counter()
+    db = data_processor.ingest_files(file_paths)
+    ingest_seconds = time.perf_counter() - start
+    ingest_trace = last_trace().to_dict()
+    stages_ms = ingest_trace["stages_ms"]
+    pages = ingest_trace.get("pages", 0)
+    n_chunks = db.index.ntotal if db is not None else 0
+    results["ingestion"] = {
+        "seconds": ingest_seconds,
+        "pages": pages,
+        "chunks": n_chunks,
+        "pages_per_second": pages / ingest_seconds,
+        "chunks_per_second": n_chunks / ingest_seconds,
+        # Construction de l'index seule (après parsing et embedding) : chargement, fusion, sauvegarde
+        "index_build_seconds": sum(stages_ms.get(name, 0.0) for name in ("load_index", "merge", "save")) / 1000,
+        "stages_ms": {name: stages_ms[name] for name in
+                      ("embed", "merge", "write_snapshot", "ann_index", "bm25_index", "save") if name in stages_ms},
+        "parse_embed_wall_ms": ingest_trace.get("parse_embed_wall_ms"),
+        "embedding_cache": embedding_cache_stats(),
+    }
+
+    # Chargement à froid de l'index pour la recherche
+    start = time.perf_counter()
+    data_processor.vector_store_manager.invalidate()
+    pipeline = chatbot.get_pipeline()
+    results["index_load_seconds"] = time.perf_counter() - start
+
+    # Recherche seule et rappel@k
+    retrieval_ms, found = [], 0
+    for _ in range(repeat):
+        for expected in questions:
+            start = time.perf_counter()
+            docs = pipeline.retriever.invoke(expected["question"])
+            retrieval_ms.append((time.perf_counter() - start) * 1000)
+            found += any(_is_relevant(doc, expected) for doc in docs[:k])
+    results["retrieval_ms"] = _percentiles(retrieval_ms)
+    results["recall_at_k"] = found / (len(questions) * repeat) if questions else None
+
+    # Pipeline complète (LLM factice) : condensation, recherche, génération
+    end_to_end_ms = []
+    for expected in questions:
+        start = time.perf_counter()
+        chatbot.custom_qa_chain(expected["question"], [])
+        end_to_end_ms.append((time.perf_counter() - start) * 1000)
+    results["end_to_end_ms"] = _percentiles(end_to_end_ms)
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results["memory"] = {
+        "python_peak_mb": peak / 1e6,
+        # ru_maxrss est en Ko sous Linux, en octets sous macOS
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1e6 if sys.platform == "darwin" else 1e3),
+    }
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne de la pipeline RAG")
+    parser.add_argument("--docs", type=int, default=20, help="Nombre de PDF synthétiques")
+    parser.add_argument("--pages", type=int, default=5, help="Pages par PDF synthétique")
+    parser.add_argument("--corpus", help="Dossier de documents à utiliser à la place du corpus synthétique")
+    parser.add_argument("--questions", help="Questions annotées (JSONL) pour --corpus")
+    parser.add_argument("--k", type=int, default=int(os.getenv("RETRIEVER_K", "3")))
+    parser.add_argument("--repeat", type=int, default=3, help="Répétitions des requêtes de recherche")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Fichier JSON de sortie (sinon stdout)")
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus_dir = args.corpus
+        questions = []
+        if args.questions:
+            with open(args.questions, encoding="utf-8") as f:
+                questions = [json.loads(line) for line in f if line.strip()]
+    else:
+        corpus_dir = os.path.join(WORKDIR, "documents")
+        os.makedirs(corpus_dir)
+        questions = generate_corpus(corpus_dir, args.docs, args.pages, args.seed)
+    file_paths = sorted(os.path.join(corpus_dir, name) for name in os.listdir(corpus_dir))
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: os.getenv(key) for key in (
+            "LLM_BACKEND", "EMBEDDING_BACKEND", "RETRIEVAL_MODE", "FAISS_INDEX_TYPE", "RETRIEVER_FETCH_K", "RERANK_MODE",
+        )},
+    }
+    # Les journaux des modules vont sur stderr : stdout ne contient que le JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report["results"] = run(file_paths, questions, args.k, args.repeat)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"📊 Résultats écrits dans {args.output} (dossier de travail : {WORKDIR})")
+    else:
+        print(output)
@@ -0,0 +1,125 @@
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+
+# Index inversé BM25 d'un instantané, à côté des vecteurs FAISS
+BM25_FILE = "bm25.sqlite"
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+# Mots vides français et anglais les plus fréquents : inutiles pour la recherche lexicale
+STOPWORDS = {
+    "le", "la", "les", "un", "une", "des", "de", "du", "d", "l", "et", "ou", "a", "à", "au", "aux",
+    "en", "est", "sont", "ce", "c", "qu", "que", "qui", "quoi", "quel", "quelle", "pour", "par",
+    "sur", "dans", "avec", "il", "elle", "on", "ne", "pas", "se", "s", "son", "sa", "ses", "the",
+    "of", "and", "to", "is", "in", "what",
+}
+
+def tokenize(text: str) -> list:
+    """Termes d'un texte : minuscules, sans accents, sans mots vides (IPv4 -> ipv4)"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [token for token in _TOKEN_RE.findall(text) if token not in STOPWORDS]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (chunk_id TEXT PRIMARY KEY, length INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID;
+INSERT OR IGNORE INTO meta (key, value) VALUES ('n_docs', 0), ('total_length', 0);
+"""
+
+def update_bm25_index(db, snapshot_path: str, previous_snapshot_path: str = None):
+    """Met à jour l'index BM25 d'un instantané à partir du précédent.
+
+    Seuls les chunks ajoutés ou supprimés depuis l'instantané précédent sont
+    indexés ou retirés ; le reste de l'index est recopié tel quel.
+    """
+    path = os.path.join(snapshot_path, BM25_FILE)
+    if previous_snapshot_path and os.path.exists(os.path.join(previous_snapshot_path, BM25_FILE)):
+        shutil.copyfile(os.path.join(previous_snapshot_path, BM25_FILE), path)
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(_SCHEMA)
+        indexed = {row[0] for row in conn.execute("SELECT chunk_id FROM docs")}
+        current = set(db.index_to_docstore_id.values())
+        removed = indexed - current
+        added = current - indexed
+
+        for chunk_id in removed:
+            terms = conn.execute("SELECT term FROM postings WHERE chunk_id = ?", (chunk_id,)).fetchall()
+            conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", terms)
+            conn.execute("DELETE FROM postings WHERE chunk_id = ?", (chunk_id,))
+            length = conn.execute("SELECT length FROM docs WHERE chunk_id = ?", (chunk_id,)).fetchone()[0]
+            conn.execute("DELETE FROM docs WHERE chunk_id = ?", (chunk_id,))
+            conn.execute("UPDATE meta SET value = value - ? WHERE key = 'total_length'", (length,))
+        conn.execute("DELETE FROM terms WHERE df <= 0")
+
+        for chunk_id in added:
+            tokens = tokenize(db.docstore.search(chunk_id).page_content)
+            counts = Counter(tokens)
+            conn.execute("INSERT INTO docs (chunk_id, length) VALUES (?, ?)", (chunk_id, len(tokens)))
+            conn.executemany(
+                "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                [(term, chunk_id, tf) for term, tf in counts.items()]
+            )
+            conn.executemany(
+                "INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                [(term,) for term in counts]
+            )
+            conn.execute("UPDATE meta SET value = value + ? WHERE key = 'total_length'", (len(tokens),))
+
+        conn.execute("UPDATE meta SET value = (SELECT COUNT(*) FROM docs) WHERE key = 'n_docs'")
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"🔤 Index BM25 mis à jour : +{len(added)} / -{len(removed)} chunks.")
+
+class BM25Index:
+    """Recherche lexicale BM25 en lecture seule sur l'index inversé d'un instantané"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        self.n_docs = meta["n_docs"]
+        self.avg_length = meta["total_length"] / self.n_docs if self.n_docs else 0.0
+
+    @classmethod
+    def open(cls, snapshot_path: str):
+        """Ouvre l'index BM25 d'un instantané, None s'il n'en a pas"""
+        if not snapshot_path:
+            return None
+        path = os.path.join(snapshot_path, BM25_FILE)
+        return cls(path) if os.path.exists(path) else None
+
+    def search(self, query: str, k: int = 10) -> list:
+        """Retourne [(chunk_id, score)] triés par score BM25 décroissant"""
+        terms = set(tokenize(query))
+        if not terms or not self.n_docs:
+            return []
+        scores = Counter()
+        with self._lock:
+            for term in terms:
+                row = self.conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+                if row is None:
+                    continue
+                idf = math.log(1 + (self.n_docs - row[0] + 0.5) / (row[0] + 0.5))
+                for chunk_id, tf, length in self.conn.execute(
+                    "SELECT p.chunk_id, p.tf, d.length FROM postings p JOIN docs d USING (chunk_id) "
+                    "WHERE p.term = ?", (term,)
+                ):
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / (self.avg_length or 1))
+                    scores[chunk_id] += idf * tf * (BM25_K1 + 1) / norm
+        return scores.most_common(k)
@@ -1,17 +1,28 @@
+import asyncio
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
 from langchain_community.vectorstores import FAISS
-from langchain.schema import SystemMessage, HumanMessage, AIMessage
+from langchain.schema import SystemMessage, HumanMessage, AIMessage, get_buffer_string
+from langchain.schema.output_parser import StrOutputParser
 from langchain.prompts.chat import (
     ChatPromptTemplate,
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate,
     MessagesPlaceholder,
 )
-from data_processor import get_vector_store
+from course_collections import DEFAULT_COLLECTION, MAX_LOADED_COLLECTIONS, collection_stores
+from embeddings import get_embeddings
+from openai_clients import chat_model
+from answer_cache import SemanticAnswerCache
+from conversation_memory import ConversationMemory
+from tokenizer import count_message_tokens
+from retrieval import build_collections_retriever
+from tracing import increment, record, stage, trace
 
 load_dotenv()
 
@@ -54,60 +65,309 @@ combine_docs_prompt = ChatPromptTemplate.from_messages([
     )
 ])
 
-llm = ChatOpenAI(model_name="gpt-4o", temperature=0.5)
+ANSWER_MODEL = os.getenv("ANSWER_MODEL", "gpt-4o")
+llm = chat_model(ANSWER_MODEL, temperature=0.5)
 
-def custom_qa_chain(question: str, chat_history: list):
-    vector_store = get_vector_store()
+# Reformulation de la question de suivi : "auto" (heuristique), "always" ou "never"
+CONDENSE_MODE = os.getenv("CONDENSE_MODE", "auto")
+# Modèle plus petit pour la reformulation, tâche simple et déterministe
+CONDENSE_MODEL = os.getenv("CONDENSE_MODEL", "gpt-4o-mini")
+condense_llm = chat_model(CONDENSE_MODEL, temperature=0)
 
+def build_condense_chain(model):
+    return CONDENSE_QUESTION_PROMPT | model | StrOutputParser()
+
+# Chaîne de reformulation sans état, construite une seule fois pour tout le process
+condense_chain = build_condense_chain(condense_llm)
+
+# Cache sémantique des réponses, partagé par toutes les sessions du process
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+answer_cache = SemanticAnswerCache(get_embeddings())
+
+def format_chat_history(chat_history: list) -> list:
+    """Convertit l'historique Streamlit en messages LangChain"""
     formatted_history = []
     for msg in chat_history:
         if msg["role"] == "user":
             formatted_history.append(HumanMessage(content=msg["content"]))
         elif msg["role"] == "assistant":
             formatted_history.append(AIMessage(content=msg["content"]))
+    return formatted_history
 
-    if not vector_store:
-        response = llm.predict_messages(
-            fallback_prompt.format_prompt(chat_history=formatted_history, question=question).to_messages()
-        )
-        return {"answer": response.content, "source_documents": []}
+def _previous_turns(question: str, chat_history: list) -> list:
+    # app.py ajoute la question courante à l'historique avant l'appel
+    if chat_history and chat_history[-1]["role"] == "user" and chat_history[-1]["content"] == question:
+        return chat_history[:-1]
+    return chat_history
 
-    retriever = vector_store.as_retriever(
-        search_type="similarity_score_threshold",
-        search_kwargs={"score_threshold": 0.7, "k": 3}
-    )
+# Mots qui renvoient à un échange précédent : la question n'est pas autonome
+_FOLLOW_UP_WORDS = {
+    "il", "elle", "ils", "elles", "lui", "leur", "leurs", "eux", "ça", "ca", "cela", "ceci",
+    "celui", "celle", "ceux", "celles", "ce", "cet", "cette", "ces", "son", "sa", "ses",
+    "dessus", "là", "précédent", "précédente", "même", "autre", "encore", "aussi",
+    "it", "its", "this", "that", "these", "those", "they", "them",
+}
+_FOLLOW_UP_STARTS = ("et ", "mais ", "donc ", "alors ", "pourquoi", "comment ça", "plus de", "and ", "why")
+_WORD_RE = re.compile(r"[\w'’-]+")
 
-    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True, output_key="answer")
-    for msg in chat_history:
-        if msg["role"] == "user":
-            memory.chat_memory.add_user_message(msg["content"])
-        elif msg["role"] == "assistant":
-            memory.chat_memory.add_ai_message(msg["content"])
-
-    qa_chain = ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=retriever,
-        memory=memory,
-        combine_docs_chain_kwargs={"prompt": combine_docs_prompt},  
-        return_source_documents=True,
-        output_key="answer"
+def needs_condensing(question: str, formatted_history: list) -> bool:
+    """Heuristique : la question dépend-elle de l'historique ?
+
+    Premier tour : jamais. Ensuite, on reformule si la question est très courte
+    ou contient un pronom/démonstratif qui renvoie à l'échange précédent.
+    """
+    if not formatted_history or CONDENSE_MODE == "never":
+        return False
+    if CONDENSE_MODE == "always":
+        return True
+    lowered = question.strip().lower()
+    words = [w.strip("'’-") for w in _WORD_RE.findall(lowered)]
+    # Élisions : "l'utilité" -> "l", "utilité" ; "qu'il" -> "il"
+    words = [part for w in words for part in re.split(r"['’]", w) if part]
+    if len(words) <= 3:
+        return True
+    if lowered.startswith(_FOLLOW_UP_STARTS):
+        return True
+    return any(w in _FOLLOW_UP_WORDS for w in words)
+
+def condense_question(question: str, formatted_history: list) -> str:
+    """Reformule la question en question autonome à partir de l'historique"""
+    if not needs_condensing(question, formatted_history):
+        record("condensed", False)
+        return question
+    record("condensed", True)
+    with stage("condense"):
+        return condense_chain.invoke({
+            "question": question,
+            "chat_history": get_buffer_string(formatted_history),
+        })
+
+def new_conversation_memory() -> ConversationMemory:
+    """Mémoire bornée d'une session, résumée avec le petit modèle"""
+    return ConversationMemory(condense_llm)
+
+class RagPipeline:
+    """Pipeline RAG construite une fois par version de l'index et partagée.
+
+    Elle ne garde aucun état de session : l'historique et la mémoire de chaque
+    utilisateur sont passés à chaque appel. Elle couvre une ou plusieurs
+    collections ; `version` combine la version de l'index de chacune.
+    """
+
+    def __init__(self, stores: dict, version: str):
+        # {collection: (vector_store, snapshot_path)}
+        self.stores = stores
+        self.version = version
+        self.retriever = build_collections_retriever(stores)
+
+    def retrieve(self, question: str) -> list:
+        return self.retriever.invoke(question)
+
+    def build_messages(self, question: str, source_documents: list) -> list:
+        context = "\n\n".join(doc.page_content for doc in source_documents)
+        return combine_docs_prompt.format_prompt(context=context, question=question).to_messages()
+
+# Pipelines par ensemble de collections interrogées, les moins récentes libérées (LRU)
+_pipelines = OrderedDict()
+_pipeline_lock = threading.Lock()
+
+def _same_stores(pipeline, stores: dict) -> bool:
+    return pipeline.stores.keys() == stores.keys() and all(
+        pipeline.stores[name][0] is store for name, (store, _) in stores.items()
     )
 
-    result = qa_chain.invoke({"question": question, "chat_history": chat_history})
-    return result
+def _drop_pipelines(collection: str):
+    """Libère les pipelines d'une collection déchargée : elles gardent ses index en mémoire"""
+    with _pipeline_lock:
+        for names in [names for names in _pipelines if collection in names]:
+            del _pipelines[names]
 
-def create_chatbot_chain():
-    vector_store = get_vector_store()
-    if not vector_store:
-        print("Vector database non trouvée.")
+collection_stores.on_evict(_drop_pipelines)
+
+def get_pipeline(collections: list = None):
+    """Retourne la pipeline des collections demandées, reconstruite seulement si un index change"""
+    names = tuple(sorted(set(collections or [DEFAULT_COLLECTION])))
+    stores, versions = {}, []
+    for name in names:
+        manager = collection_stores.get_manager(name)
+        vector_store = manager.get()
+        # Une collection sans index ne bloque pas la recherche dans les autres
+        if vector_store is not None:
+            stores[name] = (vector_store, manager.snapshot_path)
+            versions.append(f"{name}@{manager.version}")
+    if not stores:
+        print(f"⚠️ Aucune base FAISS trouvée pour : {', '.join(names)}")
         return None
 
-    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True, output_key="answer")
-    qa_chain = ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=vector_store.as_retriever(),
-        memory=memory,
-        return_source_documents=True,
-        output_key="answer"
-    )
-    return qa_chain
+    pipeline = _pipelines.get(names)
+    if pipeline is not None and _same_stores(pipeline, stores):
+        return pipeline
+    with _pipeline_lock:
+        pipeline = _pipelines.get(names)
+        if pipeline is None or not _same_stores(pipeline, stores):
+            pipeline = RagPipeline(stores, "|".join(versions))
+            _pipelines[names] = pipeline
+        _pipelines.move_to_end(names)
+        while len(_pipelines) > MAX_LOADED_COLLECTIONS:
+            _pipelines.popitem(last=False)
+        return pipeline
+
+def _prepare_turn(question: str, chat_history: list, memory: ConversationMemory = None,
+                  collections: list = None):
+    """Retourne (pipeline, historique formaté, question autonome) pour une question"""
+    with stage("load_index"):
+        pipeline = get_pipeline(collections)
+    memory = memory or new_conversation_memory()
+    with stage("memory"):
+        formatted_history = memory.build(format_chat_history(_previous_turns(question, chat_history)))
+    if not pipeline:
+        return None, formatted_history, question
+    return pipeline, formatted_history, condense_question(question, formatted_history)
+
+def _build_messages(pipeline, formatted_history: list, question: str):
+    """Retourne (messages pour le LLM, documents sources)"""
+    if not pipeline:
+        messages = fallback_prompt.format_prompt(chat_history=formatted_history, question=question).to_messages()
+        _log_prompt_tokens(messages, formatted_history)
+        return messages, []
+
+    with stage("retrieval"):
+        source_documents = pipeline.retrieve(question)
+    messages = pipeline.build_messages(question, source_documents)
+    _log_prompt_tokens(messages, formatted_history)
+    return messages, source_documents
+
+def _log_prompt_tokens(messages: list, formatted_history: list):
+    prompt_tokens = count_message_tokens(messages)
+    history_tokens = count_message_tokens(formatted_history)
+    record("prompt_tokens", prompt_tokens)
+    record("history_tokens", history_tokens)
+    increment("tokens", "prompt", prompt_tokens)
+    print(f"🔢 Tokens du prompt : {prompt_tokens} (historique : {history_tokens})")
+
+def _cached_answer(pipeline, standalone_question: str):
+    # Sans documents, la réponse dépend de l'historique : pas de cache
+    if not pipeline or not ANSWER_CACHE_ENABLED:
+        return None
+    with stage("answer_cache"):
+        cached = answer_cache.get(standalone_question, pipeline.version)
+    record("answer_cache_hit", bool(cached))
+    increment("cache", "answer_hit" if cached else "answer_miss")
+    if cached:
+        print(f"♻️ Réponse servie depuis le cache sémantique : {standalone_question}")
+    return cached
+
+def _store_answer(pipeline, standalone_question: str, result: dict):
+    if pipeline and ANSWER_CACHE_ENABLED:
+        answer_cache.put(standalone_question, pipeline.version, {
+            "answer": result["answer"],
+            "source_documents": result["source_documents"],
+        })
+
+def custom_qa_chain(question: str, chat_history: list, memory: ConversationMemory = None,
+                    collections: list = None):
+    with trace("qa"):
+        pipeline, formatted_history, standalone_question = _prepare_turn(question, chat_history, memory, collections)
+        cached = _cached_answer(pipeline, standalone_question)
+        if cached:
+            return {"question": question, **cached}
+
+        messages, source_documents = _build_messages(pipeline, formatted_history, standalone_question)
+        with stage("generation"):
+            response = llm.invoke(messages)
+        result = {"question": question, "answer": response.content, "source_documents": source_documents}
+        _store_answer(pipeline, standalone_question, result)
+        return result
+
+async def acustom_qa_chain(question: str, chat_history: list, memory: ConversationMemory = None,
+                           collections: list = None, generate=None, condense=None):
+    """Version asynchrone de custom_qa_chain (appels réseau non bloquants).
+
+    `generate(messages)` et `condense(inputs)` remplacent les appels à `llm` et
+    à `condense_chain` : AsyncQAEngine y place son sémaphore et ses retries.
+    """
+    generate = generate or llm.ainvoke
+    condense = condense or condense_chain.ainvoke
+    with trace("qa_async"):
+        # Chargement de l'index, résumé de l'historique et cache restent synchrones : dans un thread
+        with stage("load_index"):
+            pipeline = await asyncio.to_thread(get_pipeline, collections)
+        memory = memory or new_conversation_memory()
+        with stage("memory"):
+            formatted_history = await asyncio.to_thread(
+                memory.build, format_chat_history(_previous_turns(question, chat_history))
+            )
+        standalone_question = question
+        if pipeline and needs_condensing(question, formatted_history):
+            record("condensed", True)
+            with stage("condense"):
+                standalone_question = await condense({
+                    "question": question,
+                    "chat_history": get_buffer_string(formatted_history),
+                })
+
+        cached = await asyncio.to_thread(_cached_answer, pipeline, standalone_question)
+        if cached:
+            return {"question": question, **cached}
+
+        if pipeline:
+            with stage("retrieval"):
+                source_documents = await pipeline.retriever.ainvoke(standalone_question)
+            messages = pipeline.build_messages(standalone_question, source_documents)
+        else:
+            source_documents = []
+            messages = fallback_prompt.format_prompt(chat_history=formatted_history, question=question).to_messages()
+        _log_prompt_tokens(messages, formatted_history)
+
+        with stage("generation"):
+            response = await generate(messages)
+        result = {"question": question, "answer": response.content, "source_documents": source_documents}
+        await asyncio.to_thread(_store_answer, pipeline, standalone_question, result)
+        return result
+
+def stream_qa_chain(question: str, chat_history: list, memory: ConversationMemory = None,
+                    collections: list = None):
+    """Variante en streaming de custom_qa_chain.
+
+    Retourne (source_documents, tokens) : les sources sont disponibles dès la
+    fin de la recherche, `tokens` est un générateur des morceaux de réponse.
+    La trace de la requête se termine avec le générateur.
+    """
+    start = time.perf_counter()
+    with trace("qa_stream", defer_finish=True) as current:
+        pipeline, formatted_history, standalone_question = _prepare_turn(question, chat_history, memory, collections)
+        cached = _cached_answer(pipeline, standalone_question)
+        if not cached:
+            messages, source_documents = _build_messages(pipeline, formatted_history, standalone_question)
+    if cached:
+        current.finish()
+        return cached["source_documents"], iter([cached["answer"]])
+
+    def tokens():
+        generation_start = time.perf_counter()
+        first_token = True
+        answer = ""
+        try:
+            for chunk in llm.stream(messages):
+                if not chunk.content:
+                    continue
+                if first_token:
+                    current.set("first_token_ms", round((time.perf_counter() - start) * 1000, 2))
+                    print(f"⏱️ Premier token après {time.perf_counter() - start:.2f}s")
+                    first_token = False
+                answer += chunk.content
+                yield chunk.content
+            print(f"⏱️ Réponse complète après {time.perf_counter() - start:.2f}s")
+            _store_answer(pipeline, standalone_question, {"answer": answer, "source_documents": source_documents})
+        finally:
+            current.add_stage("generation", time.perf_counter() - generation_start)
+            current.finish()
+
+    return source_documents, tokens()
+
+def create_chatbot_chain(collections: list = None):
+    """Retourne la pipeline partagée des collections demandées, None si aucun index"""
+    pipeline = get_pipeline(collections)
+    if not pipeline:
+        print("Vector database non trouvée.")
+    return pipeline
@@ -0,0 +1,215 @@
+import os
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+from langchain.schema.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from embeddings import EMBEDDING_BACKEND
+from tokenizer import count_tokens
+
+# Taille cible des chunks en tokens selon le modèle d'embeddings
+# (le MiniLM local tronque au-delà de 128 tokens : inutile d'envoyer plus)
+_DEFAULT_CHUNK_TOKENS = {"openai": 400, "local": 120, "hashing": 400}
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "0")) or _DEFAULT_CHUNK_TOKENS.get(EMBEDDING_BACKEND, 400)
+# Recouvrement entre deux morceaux d'une même section trop longue (10 % au lieu de 20 %)
+CHUNK_OVERLAP_RATIO = float(os.getenv("CHUNK_OVERLAP_RATIO", "0.1"))
+# Similarité de Jaccard estimée (MinHash) au-delà de laquelle un chunk est un quasi-doublon ; 0 = désactivé
+CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.9"))
+# Enregistré dans le manifeste : un changement de découpage ré-indexe les fichiers
+CHUNKER_VERSION = f"v1-{CHUNK_TOKENS}-{CHUNK_OVERLAP_RATIO}-{CHUNK_DEDUP_THRESHOLD}"
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_WORD_RE = re.compile(r"\w+")
+# Éléments Unstructured répétés d'une page à l'autre ou sans contenu
+_SKIPPED_CATEGORIES = {"Header", "Footer", "PageBreak", "PageNumber"}
+
+def _splitter(chunk_tokens: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_tokens,
+        chunk_overlap=int(chunk_tokens * CHUNK_OVERLAP_RATIO),
+        length_function=count_tokens,
+        separators=["\n\n", "\n", ". ", " ", ""],
+    )
+
+def _split_section(text: str, heading: str, metadata: dict, chunk_tokens: int) -> list:
+    """Une section tient dans un chunk si possible ; sinon chaque morceau rappelle son titre"""
+    if count_tokens(text) <= chunk_tokens:
+        return [Document(page_content=text, metadata=dict(metadata))]
+    prefix = f"{heading}\n" if heading else ""
+    if heading:
+        # La ligne de titre est portée par le préfixe : seule, elle ferait un chunk vide de contenu
+        first_line, _, body = text.partition("\n")
+        if _HEADING_RE.match(first_line) or first_line.strip() == heading.split(" > ")[-1]:
+            text = body
+    pieces = _splitter(max(chunk_tokens - count_tokens(prefix), 32)).split_text(text)
+    return [Document(page_content=prefix + piece, metadata=dict(metadata)) for piece in pieces]
+
+def _pack_sections(sections: list, metadata: dict, chunk_tokens: int) -> list:
+    """Regroupe les sections courtes consécutives sans jamais couper une section qui tient dans un chunk"""
+    chunks = []
+    buffer, buffer_heading, buffer_tokens = [], None, 0
+    for heading, text in sections:
+        tokens = count_tokens(text)
+        if buffer and buffer_tokens + tokens > chunk_tokens:
+            chunks.append(Document(page_content="\n\n".join(buffer), metadata={**metadata, "section": buffer_heading}))
+            buffer, buffer_heading, buffer_tokens = [], None, 0
+        if tokens > chunk_tokens:
+            chunks.extend(_split_section(text, heading, {**metadata, "section": heading}, chunk_tokens))
+            continue
+        if not buffer:
+            buffer_heading = heading
+        buffer.append(text)
+        buffer_tokens += tokens
+    if buffer:
+        chunks.append(Document(page_content="\n\n".join(buffer), metadata={**metadata, "section": buffer_heading}))
+    return chunks
+
+def markdown_sections(text: str) -> list:
+    """Découpe un Markdown en [(chemin des titres, texte de la section)]"""
+    sections, lines, path = [], [], []
+    in_fence = False
+
+    def flush():
+        body = "\n".join(lines).strip()
+        # Titre sans texte (ex. "# A" suivi de "## B") : son chemin est repris par les sous-sections
+        if body and not all(_HEADING_RE.match(line) for line in body.splitlines() if line.strip()):
+            sections.append((" > ".join(title for _, title in path), body))
+
+    for line in text.splitlines():
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+        match = None if in_fence else _HEADING_RE.match(line)
+        if match:
+            flush()
+            lines = []
+            level = len(match.group(1))
+            path = [(lvl, title) for lvl, title in path if lvl < level] + [(level, match.group(2))]
+        lines.append(line)
+    flush()
+    return sections
+
+def element_sections(elements: list) -> list:
+    """Regroupe les éléments Unstructured (DOCX) en sections qui commencent à chaque titre"""
+    sections, lines, heading = [], [], ""
+    for element in elements:
+        category = element.metadata.get("category")
+        text = element.page_content.strip()
+        if category in _SKIPPED_CATEGORIES or not text:
+            continue
+        if category == "Title":
+            if lines:
+                sections.append((heading, "\n".join(lines)))
+            lines, heading = [], text
+        lines.append(text)
+    if lines:
+        sections.append((heading, "\n".join(lines)))
+    return sections
+
+_PAGE_NUMBER_RE = re.compile(r"^(page|p\.)?\s*\d+\s*((/|sur|of|de)\s*\d+)?$")
+
+def _normalize_line(line: str) -> str:
+    line = " ".join(line.lower().split())
+    # "Page 3 / 12" et "Page 4 / 12" sont la même ligne de pied de page ; les autres
+    # lignes gardent leurs nombres ("réseau 1" et "réseau 2" sont du contenu)
+    return re.sub(r"\d+", "#", line) if _PAGE_NUMBER_RE.match(line) else line
+
+def strip_repeated_lines(pages: list, edge_lines: int = 3, min_ratio: float = 0.5) -> list:
+    """Retire les en-têtes et pieds de page répétés (début/fin de page présents sur au moins la moitié des pages).
+
+    Une page courte (diapositive, énoncé d'exercice) n'a pas d'en-tête ni de pied
+    distincts du contenu : seules les pages nettement plus longues que les deux
+    zones de bord réunies sont examinées.
+    """
+    if len(pages) < 3:
+        return pages
+
+    def edges(lines):
+        indices = [i for i, line in enumerate(lines) if line.strip()]
+        if len(indices) < 3 * edge_lines:
+            return set()
+        return set(indices[:edge_lines] + indices[-edge_lines:])
+
+    split_pages = [page.page_content.splitlines() for page in pages]
+    counts = Counter()
+    for lines in split_pages:
+        counts.update({_normalize_line(lines[i]) for i in edges(lines)})
+    repeated = {line for line, count in counts.items() if count >= min_ratio * len(pages)}
+    if not repeated:
+        return pages
+
+    cleaned = []
+    for page, lines in zip(pages, split_pages):
+        drop = {i for i in edges(lines) if _normalize_line(lines[i]) in repeated}
+        text = "\n".join(line for i, line in enumerate(lines) if i not in drop)
+        cleaned.append(Document(page_content=text, metadata=page.metadata))
+    return cleaned
+
+# MinHash : 64 permutations (a*x + b) mod p, LSH en 16 bandes de 4 lignes
+_MINHASH_PRIME = np.uint64(4294967311)
+_rng = np.random.default_rng(0)
+_MINHASH_A = _rng.integers(1, 1 << 31, size=64, dtype=np.uint64)
+_MINHASH_B = _rng.integers(0, 1 << 31, size=64, dtype=np.uint64)
+_LSH_BANDS = 16
+
+def minhash_signature(text: str, shingle_size: int = 3) -> np.ndarray:
+    words = _WORD_RE.findall(text.lower())
+    shingles = {" ".join(words[i:i + shingle_size]) for i in range(max(len(words) - shingle_size + 1, 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    return ((_MINHASH_A[:, None] * hashes[None, :] + _MINHASH_B[:, None]) % _MINHASH_PRIME).min(axis=1)
+
+def deduplicate(chunks: list, threshold: float = CHUNK_DEDUP_THRESHOLD) -> list:
+    """Supprime les quasi-doublons (MinHash + LSH), en gardant la première occurrence"""
+    if not threshold or len(chunks) < 2:
+        return chunks
+    rows = len(_MINHASH_A) // _LSH_BANDS
+    buckets = {}
+    kept, signatures = [], []
+    for chunk in chunks:
+        signature = minhash_signature(chunk.page_content)
+        keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(_LSH_BANDS)]
+        candidates = {index for key in keys for index in buckets.get(key, ())}
+        if any(np.mean(signatures[index] == signature) >= threshold for index in candidates):
+            continue
+        for key in keys:
+            buckets.setdefault(key, []).append(len(kept))
+        kept.append(chunk)
+        signatures.append(signature)
+    return kept
+
+def chunk_documents(documents: list, chunk_tokens: int = CHUNK_TOKENS) -> list:
+    """Découpe les documents d'un même fichier selon sa structure, puis retire les quasi-doublons.
+
+    Markdown et DOCX : par section (titres), CSV : lignes entières regroupées,
+    PDF : page par page sans en-têtes/pieds répétés, autres : texte brut.
+    Les tailles sont en tokens (voir CHUNK_TOKENS).
+    """
+    if not documents:
+        return []
+    source = documents[0].metadata.get("source", "")
+    extension = os.path.splitext(source)[1].lower()
+    base_metadata = {"source": source}
+
+    if extension == ".md":
+        text = "\n\n".join(doc.page_content for doc in documents)
+        chunks = _pack_sections(markdown_sections(text), base_metadata, chunk_tokens)
+    elif extension == ".docx" and any("category" in doc.metadata for doc in documents):
+        chunks = _pack_sections(element_sections(documents), base_metadata, chunk_tokens)
+    elif extension == ".csv":
+        rows = [(f"ligne {doc.metadata.get('row')}", doc.page_content) for doc in documents]
+        # Lignes jamais coupées ; "section" indique la première ligne du groupe
+        chunks = _pack_sections(rows, base_metadata, chunk_tokens)
+    else:
+        if extension == ".pdf":
+            documents = strip_repeated_lines(documents)
+        chunks = []
+        for doc in documents:
+            if doc.page_content.strip():
+                chunks.extend(_split_section(doc.page_content, "", doc.metadata, chunk_tokens))
+
+    kept = deduplicate(chunks)
+    if len(kept) < len(chunks):
+        print(f"♻️ {len(chunks) - len(kept)} chunk(s) quasi-dupliqué(s) ignoré(s) : {source}")
+    return kept
@@ -0,0 +1,78 @@
+import hashlib
+import os
+
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.schema import SystemMessage, get_buffer_string
+from langchain.schema.output_parser import StrOutputParser
+
+from tokenizer import count_message_tokens, count_tokens
+
+# Budget de tokens pour l'historique envoyé au LLM
+MAX_HISTORY_TOKENS = int(os.getenv("MAX_HISTORY_TOKENS", "1500"))
+# Nombre de derniers tours (question + réponse) gardés mot pour mot
+KEEP_LAST_TURNS = int(os.getenv("KEEP_LAST_TURNS", "3"))
+
+def _fingerprint(messages: list) -> str:
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(f"{message.type}\0{message.content}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+class ConversationMemory:
+    """Historique borné par un budget de tokens.
+
+    Tant que le budget le permet, tout l'historique non résumé reste mot pour mot
+    (aucun appel au LLM). Au dépassement, tout ce qui précède les
+    `keep_last_turns` derniers tours est intégré d'un coup au résumé glissant :
+    un appel de résumé pour plusieurs tours, pas un par tour.
+    Une instance par session (st.session_state), jamais partagée.
+    """
+
+    def __init__(self, summarizer_llm, max_tokens: int = MAX_HISTORY_TOKENS,
+                 keep_last_turns: int = KEEP_LAST_TURNS):
+        self.summarizer_llm = summarizer_llm
+        self.max_tokens = max_tokens
+        self.keep_last_turns = keep_last_turns
+        self.summary = ""
+        self._summarized_count = 0
+        self._summarized_fingerprint = _fingerprint([])
+
+    def reset(self):
+        self.summary = ""
+        self._summarized_count = 0
+        self._summarized_fingerprint = _fingerprint([])
+
+    def _fold(self, messages: list, count: int):
+        """Intègre messages[self._summarized_count:count] au résumé"""
+        new_lines = messages[self._summarized_count:count]
+        if not new_lines:
+            return
+        self.summary = (SUMMARY_PROMPT | self.summarizer_llm | StrOutputParser()).invoke({
+            "summary": self.summary,
+            "new_lines": get_buffer_string(new_lines),
+        })
+        self._summarized_count = count
+        self._summarized_fingerprint = _fingerprint(messages[:count])
+
+    def build(self, messages: list) -> list:
+        """Retourne l'historique à envoyer au LLM : résumé éventuel + derniers tours"""
+        # Historique remplacé (nouveau chat, autre conversation) : on repart de zéro
+        if (self._summarized_count > len(messages)
+                or _fingerprint(messages[:self._summarized_count]) != self._summarized_fingerprint):
+            self.reset()
+
+        def over_budget(start: int) -> bool:
+            return count_tokens(self.summary) + count_message_tokens(messages[start:]) > self.max_tokens
+
+        window_start = self._summarized_count
+        if over_budget(window_start):
+            window_start = max(len(messages) - 2 * self.keep_last_turns, window_start)
+            # Derniers tours encore trop gros pour le budget : on résume aussi leurs plus anciens messages
+            while window_start < len(messages) - 1 and over_budget(window_start):
+                window_start += 1
+            self._fold(messages, window_start)
+
+        history = list(messages[window_start:])
+        if self.summary:
+            history.insert(0, SystemMessage(content=f"Résumé de la conversation précédente :\n{self.summary}"))
+        return history
@@ -0,0 +1,86 @@
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from data_processor import DOCS_DIR, INDEX_DIR, VectorStoreManager, vector_store_manager
+
+# Collections nommées (cours, classe, utilisateur) : documents, index et manifeste séparés
+COLLECTIONS_DIR = os.getenv("COLLECTIONS_DIR", "collections")
+# La collection par défaut réutilise DOCS_DIR et INDEX_DIR (index existants conservés)
+DEFAULT_COLLECTION = os.getenv("DEFAULT_COLLECTION", "general")
+# Nombre maximal de collections gardées chargées en mémoire (LRU)
+MAX_LOADED_COLLECTIONS = int(os.getenv("MAX_LOADED_COLLECTIONS", "8"))
+
+def collection_slug(name: str) -> str:
+    """Nom de dossier sûr pour une collection ("Réseaux L2" -> "reseaux-l2")"""
+    name = unicodedata.normalize("NFKD", name.strip().lower())
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    slug = re.sub(r"[^a-z0-9_-]+", "-", name).strip("-")
+    if not slug:
+        raise ValueError(f"Nom de collection invalide : {name!r}")
+    return slug
+
+def collection_paths(name: str):
+    """Retourne (dossier des documents, dossier de l'index) d'une collection"""
+    if name == DEFAULT_COLLECTION:
+        return DOCS_DIR, INDEX_DIR
+    slug = collection_slug(name)
+    root = os.path.join(COLLECTIONS_DIR, slug)
+    return os.path.join(root, "documents"), os.path.join(root, "faiss_index")
+
+def list_collections() -> list:
+    names = [DEFAULT_COLLECTION]
+    if os.path.isdir(COLLECTIONS_DIR):
+        names += sorted(
+            name for name in os.listdir(COLLECTIONS_DIR)
+            if os.path.isdir(os.path.join(COLLECTIONS_DIR, name)) and name != DEFAULT_COLLECTION
+        )
+    return names
+
+def create_collection(name: str) -> str:
+    """Crée une collection vide, retourne son nom normalisé"""
+    slug = collection_slug(name)
+    docs_dir, _ = collection_paths(slug)
+    os.makedirs(docs_dir, exist_ok=True)
+    print(f"📁 Collection créée : {slug}")
+    return slug
+
+class CollectionStores:
+    """Un VectorStoreManager par collection ; au-delà de `max_loaded`, les moins
+    récemment interrogés sont déchargés et rechargés à la demande depuis le disque.
+    Les fonctions enregistrées avec `on_evict` sont appelées avec le nom de chaque
+    collection déchargée (ex. pour libérer les pipelines qui la référencent).
+    """
+
+    def __init__(self, max_loaded: int = MAX_LOADED_COLLECTIONS):
+        self.max_loaded = max_loaded
+        self._lock = threading.Lock()
+        self._managers = OrderedDict()
+        self._evict_callbacks = []
+
+    def on_evict(self, callback):
+        self._evict_callbacks.append(callback)
+
+    def get_manager(self, name: str) -> VectorStoreManager:
+        evicted_names = []
+        with self._lock:
+            manager = self._managers.get(name)
+            if manager is None:
+                # La collection par défaut partage le manager global de data_processor
+                manager = vector_store_manager if name == DEFAULT_COLLECTION else VectorStoreManager(collection_paths(name)[1])
+                self._managers[name] = manager
+            self._managers.move_to_end(name)
+            while len(self._managers) > self.max_loaded:
+                evicted_name, evicted = self._managers.popitem(last=False)
+                # Les requêtes en cours gardent leur référence à l'index
+                evicted.invalidate()
+                evicted_names.append(evicted_name)
+                print(f"📤 Collection déchargée de la mémoire : {evicted_name}")
+        for evicted_name in evicted_names:
+            for callback in self._evict_callbacks:
+                callback(evicted_name)
+        return manager
+
+collection_stores = CollectionStores()
@@ -1,22 +1,22 @@
+import fcntl
+import hashlib
+import json
 import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 
-# Loaders LangChain
-from langchain_community.document_loaders import (
-    PyMuPDFLoader,                      # PDF
-    TextLoader,                         # TXT
-    UnstructuredMarkdownLoader,         # .md
-    UnstructuredWordDocumentLoader,     # .docx
-    CSVLoader                           # .csv
-)
-
-# OCR pour les images
-from PIL import Image
-import pytesseract
-from langchain.schema.document import Document  
+# Loaders (LangChain, PyMuPDF, Unstructured, OCR) et découpage : importés à la
+# demande dans load_documents / split_documents, une session de chat ne les charge pas
+from embeddings import get_embeddings
+from ann_index import load_ann_index, update_ann_index
+from index_store import VECTORS_FILE, read_snapshot, write_snapshot
+from bm25_index import update_bm25_index
+from tracing import current_trace, increment, record, stage, trace
 
 # Chargement du .env
 load_dotenv()
@@ -32,88 +32,454 @@ DOCS_DIR = "documents"
 if not os.path.exists(DOCS_DIR):
     os.makedirs(DOCS_DIR)
 
+# Dossier de l'index FAISS : un sous-dossier par instantané, CURRENT pointe sur le dernier
+INDEX_DIR = os.getenv("INDEX_DIR", "faiss_index")
+CURRENT_FILE = "CURRENT"
+KEEP_SNAPSHOTS = 2
+MANIFEST_FILE = "manifest.json"
+# Métadonnées de l'instantané : modèle d'embeddings utilisé et dimension
+META_FILE = "index_meta.json"
+
+# Verrou d'écriture de l'index (fichier voisin : survit à la suppression du dossier)
+INDEX_LOCK_SUFFIX = ".lock"
+
+# Nombre de chunks envoyés par requête d'embedding pendant l'ingestion
+EMBED_BATCH_SIZE = 256
+
 def ocr_image_to_document(file_path: str) -> list:
     """Effectue l’OCR sur une image et retourne une liste [Document]"""
+    from ocr import ocr_image_file
+
     try:
-        img = Image.open(file_path)
-        text = pytesseract.image_to_string(img)
-        if not text.strip():
-            print(f"❗ Aucun texte détecté dans l'image : {file_path}")
-            return []
-        print(f"🧾 Texte extrait de l'image ({len(text)} caractères)")
-        doc = Document(page_content=text, metadata={"source": file_path})
-        return [doc]
+        return ocr_image_file(file_path)
     except Exception as e:
         print(f"❌ Erreur OCR sur l'image {file_path} : {e}")
         return []
 
-def process_document(file_path: str):
+def load_documents(file_path: str) -> list:
+    """Charge un fichier avec le loader adapté à son extension (importé au premier fichier de ce type)"""
+    if file_path.endswith(".pdf"):
+        # Pages texte lues directement, pages scannées passées par l'OCR
+        from ocr import extract_pdf
+        return extract_pdf(file_path)
+    if file_path.endswith((".txt", ".md")):
+        # Markdown brut : titres conservés pour le découpage par section
+        from langchain_community.document_loaders import TextLoader
+        loader = TextLoader(file_path)
+    elif file_path.endswith(".docx"):
+        # Un Document par élément (titre, paragraphe, tableau) pour découper par section
+        from langchain_community.document_loaders import UnstructuredWordDocumentLoader
+        loader = UnstructuredWordDocumentLoader(file_path, mode="elements")
+    elif file_path.endswith(".csv"):
+        from langchain_community.document_loaders import CSVLoader
+        loader = CSVLoader(file_path)
+    elif file_path.endswith((".png", ".jpg", ".jpeg")):
+        return ocr_image_to_document(file_path)
+    else:
+        print(f"⚠️ Format non supporté : {file_path}")
+        return []
+    return loader.load()
+
+def split_documents(documents: list) -> list:
+    """Découpage par structure et en tokens, sans quasi-doublons (voir chunking.py)"""
+    from chunking import chunk_documents
+    return chunk_documents(documents)
+
+def load_and_split(file_path: str):
+    """Charge puis découpe un fichier, retourne (chunks, nombre de documents chargés, ex. pages d'un PDF)"""
     print(f"📄 Traitement du fichier : {file_path}")
+    documents = load_documents(file_path)
+    if not documents:
+        print(f"❌ Aucun contenu extrait : {file_path}")
+        return [], 0
+    print(f"📚 {len(documents)} document(s) chargé(s)")
+    chunks = split_documents(documents)
+    print(f"✂️ {len(chunks)} chunks générés.")
+    return chunks, len(documents)
 
-    # Sélection du bon loader selon l’extension
-    try:
-        if file_path.endswith(".pdf"):
-            loader = PyMuPDFLoader(file_path)
-            documents = loader.load()
-        elif file_path.endswith(".txt"):
-            loader = TextLoader(file_path)
-            documents = loader.load()
-        elif file_path.endswith(".md"):
-            loader = UnstructuredMarkdownLoader(file_path)
-            documents = loader.load()
-        elif file_path.endswith(".docx"):
-            loader = UnstructuredWordDocumentLoader(file_path)
-            documents = loader.load()
-        elif file_path.endswith(".csv"):
-            loader = CSVLoader(file_path)
-            documents = loader.load()
-        elif file_path.endswith((".png", ".jpg", ".jpeg")):
-            documents = ocr_image_to_document(file_path)
-        else:
-            print(f"⚠️ Format non supporté : {file_path}")
-            return None
+def file_hash(file_path: str) -> str:
+    """Hash SHA-256 du contenu d'un fichier"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-        if not documents:
-            print("❌ Aucun contenu extrait.")
-            return None
+def assign_chunk_ids(source: str, chunks: list) -> list:
+    """Calcule un identifiant stable pour chaque chunk d'un document.
 
-        print(f"📚 {len(documents)} document(s) chargé(s)")
+    L'identifiant dépend de la source, du contenu du chunk et de son rang parmi
+    les chunks identiques : un chunk inchangé garde son identifiant d'une
+    ingestion à l'autre. C'est aussi l'identifiant du vecteur dans le docstore FAISS.
+    """
+    source_prefix = hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+    seen = {}
+    entries = []
+    for chunk in chunks:
+        chunk_hash = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+        occurrence = seen.get(chunk_hash, 0)
+        seen[chunk_hash] = occurrence + 1
+        entries.append({"id": f"{source_prefix}-{chunk_hash[:16]}-{occurrence}", "hash": chunk_hash})
+    return entries
 
-        # chunking
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1500,
-            chunk_overlap=300
-        )
-        chunks = splitter.split_documents(documents)
-        print(f"✂️ {len(chunks)} chunks générés.")
+def load_manifest(snapshot_path: str = None) -> dict:
+    """Manifeste d'un instantané : hash du fichier et chunks indexés par source"""
+    if snapshot_path:
+        try:
+            with open(os.path.join(snapshot_path, MANIFEST_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+    return {"documents": {}}
+
+@contextmanager
+def index_write_lock(index_dir: str = INDEX_DIR):
+    """Un seul écrivain à la fois sur l'index, tous process confondus (verrou fcntl).
+
+    Les lecteurs ne prennent pas ce verrou : ils continuent de servir le dernier
+    instantané validé pendant qu'un écrivain en prépare un nouveau.
+    """
+    lock_path = os.path.normpath(index_dir) + INDEX_LOCK_SUFFIX
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("⏳ Index en cours d'écriture par un autre process, attente du verrou...")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def ingest_files(file_paths: list, progress_callback=None, max_workers: int = None,
+                 batch_size: int = EMBED_BATCH_SIZE, index_dir: str = INDEX_DIR):
+    """Ingère plusieurs fichiers en une seule écriture de l'index FAISS.
+
+    Le parsing et le découpage tournent en parallèle dans un pool de threads ;
+    les chunks sont envoyés à l'embedding par lots au fil de l'eau, puis tout
+    est fusionné dans l'index avec un seul chargement et une seule sauvegarde.
+    Grâce au manifeste, un fichier inchangé est ignoré et un fichier modifié ne
+    ré-embed que ses chunks nouveaux ; ses chunks disparus sont supprimés.
+    `progress_callback(file_path, n_chunks, done, total, error)` est appelé
+    depuis le thread appelant à la fin de chaque fichier.
+    """
+    if not file_paths:
+        return None
+    with trace("ingest") as current, index_write_lock(index_dir):
+        current.set("files", len(file_paths))
+        return _ingest_files(file_paths, progress_callback, max_workers, batch_size, index_dir)
+
+def _ingest_files(file_paths: list, progress_callback, max_workers: int, batch_size: int, index_dir: str):
+    from chunking import CHUNKER_VERSION
+
+    embeddings = get_embeddings()
+    hits_before, misses_before = embeddings.cache.hits, embeddings.cache.misses
+    _, snapshot_path = current_index_path(index_dir)
+    manifest = load_manifest(snapshot_path)
+    documents_manifest = manifest["documents"]
+
+    texts, metadatas, ids, vectors = [], [], [], []
+    ids_to_delete = []
+    updated_entries = {}
+    pending = 0
+    done = 0
+    pages = 0
+
+    def flush():
+        nonlocal pending
+        if pending:
+            with stage("embed"):
+                vectors.extend(embeddings.embed_documents(texts[-pending:]))
+            pending = 0
+
+    to_process = []
+    with stage("hash_files"):
+        hashes = {path: file_hash(path) for path in file_paths}
+    for path in file_paths:
+        source = os.path.normpath(path)
+        digest = hashes[path]
+        entry = documents_manifest.get(source)
+        if entry and entry["hash"] == digest and entry.get("chunker") == CHUNKER_VERSION:
+            print(f"⏭️ Fichier inchangé, ignoré : {path}")
+            done += 1
+            if progress_callback:
+                progress_callback(path, 0, done, len(file_paths), None)
+            continue
+        to_process.append((path, source, digest))
+
+    max_workers = max_workers or min(max(len(to_process), 1), os.cpu_count() or 1)
+    parse_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(load_and_split, path): (path, source, digest)
+                   for path, source, digest in to_process}
+        for future in as_completed(futures):
+            path, source, digest = futures[future]
+            done += 1
+            error = None
+            try:
+                chunks, n_pages = future.result()
+                pages += n_pages
+            except Exception as e:
+                print(f"❌ Erreur lors du traitement de {path} : {e}")
+                chunks, error = [], e
+
+            if error is None:
+                chunk_entries = assign_chunk_ids(source, chunks)
+                old_ids = {c["id"] for c in documents_manifest.get(source, {}).get("chunks", [])}
+                new_ids = {c["id"] for c in chunk_entries}
+                ids_to_delete.extend(old_ids - new_ids)
+                updated_entries[source] = {"hash": digest, "chunker": CHUNKER_VERSION, "chunks": chunk_entries}
+
+                for chunk, chunk_entry in zip(chunks, chunk_entries):
+                    if chunk_entry["id"] in old_ids:
+                        continue
+                    texts.append(chunk.page_content)
+                    metadatas.append(chunk.metadata)
+                    ids.append(chunk_entry["id"])
+                    pending += 1
+                    if pending >= batch_size:
+                        flush()
+                print(f"🔁 {source} : {len(new_ids - old_ids)} chunks à ajouter, "
+                      f"{len(old_ids - new_ids)} à supprimer.")
+
+            if progress_callback:
+                progress_callback(path, len(chunks), done, len(file_paths), error)
+    flush()
+    # Parsing et embedding se chevauchent : durée murale de la phase complète
+    record("parse_embed_wall_ms", round((time.perf_counter() - parse_start) * 1000, 2))
+    record("pages", pages)
+    record("embedding_cache_hits", embeddings.cache.hits - hits_before)
+    record("embedding_cache_misses", embeddings.cache.misses - misses_before)
+    increment("cache", "embedding_hit", embeddings.cache.hits - hits_before)
+    increment("cache", "embedding_miss", embeddings.cache.misses - misses_before)
+    print(f"💰 Cache d'embeddings : {embeddings.cache.hits - hits_before} hits, "
+          f"{embeddings.cache.misses - misses_before} misses.")
+
+    if not updated_entries:
+        print("✅ Aucune modification à indexer.")
+        return None
+
+    # FAISS : un seul chargement et une seule sauvegarde atomique
+    with stage("load_index"):
+        db = load_vector_store_for_write(embeddings, index_dir)
+    merge_start = time.perf_counter()
+    if db is not None:
+        existing_ids = set(db.index_to_docstore_id.values())
+        stale_ids = [i for i in ids_to_delete if i in existing_ids]
+        if stale_ids:
+            db.delete(stale_ids)
+            print(f"🗑️ {len(stale_ids)} chunks obsolètes supprimés de FAISS.")
+        new_items = [item for item in zip(texts, vectors, metadatas, ids) if item[3] not in existing_ids]
+        if new_items:
+            new_texts, new_vectors, new_metadatas, new_ids = zip(*new_items)
+            db.add_embeddings(list(zip(new_texts, new_vectors)), metadatas=list(new_metadatas), ids=list(new_ids))
+            print(f"✅ {len(new_items)} chunks ajoutés aux documents existants dans FAISS.")
+    elif texts:
+        db = FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadatas=metadatas, ids=ids)
+        print(f"✅ Nouvelle base FAISS créée ({len(texts)} chunks).")
+    else:
+        print("❌ Aucun contenu extrait.")
+        return None
+
+    record("chunks_added", len(texts))
+    record("chunks_deleted", len(ids_to_delete))
+    current_trace().add_stage("merge", time.perf_counter() - merge_start)
 
-        # Embedding
-        embeddings = OpenAIEmbeddings()
+    documents_manifest.update(updated_entries)
+    with stage("save"):
+        save_vector_store(db, manifest, index_dir)
+    print("💾 Base FAISS sauvegardée.")
+    return db
 
-        # FAISS
-        if os.path.exists("faiss_index"):
-            db = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-            db.add_documents(chunks)
-            print("✅ Ajout aux documents existants dans FAISS.")
-        else:
-            db = FAISS.from_documents(chunks, embeddings)
-            print("✅ Nouvelle base FAISS créée.")
+def remove_document(file_path: str, index_dir: str = INDEX_DIR) -> bool:
+    """Retire de l'index uniquement les vecteurs d'un document"""
+    with index_write_lock(index_dir):
+        return _remove_document(file_path, index_dir)
 
-        db.save_local("faiss_index")
-        print("💾 Base FAISS sauvegardée.")
-        return db
+def _remove_document(file_path: str, index_dir: str):
+    _, snapshot_path = current_index_path(index_dir)
+    manifest = load_manifest(snapshot_path)
+    entry = manifest["documents"].pop(os.path.normpath(file_path), None)
+    if entry is None:
+        print(f"⚠️ Document absent du manifeste : {file_path}")
+        return False
 
+    db = load_vector_store_for_write(get_embeddings(), index_dir)
+    existing_ids = set(db.index_to_docstore_id.values())
+    ids = [c["id"] for c in entry["chunks"] if c["id"] in existing_ids]
+    if ids:
+        db.delete(ids)
+    save_vector_store(db, manifest, index_dir)
+    print(f"🗑️ {len(ids)} chunks de {file_path} supprimés de FAISS.")
+    return True
+
+def clear_index(index_dir: str = INDEX_DIR):
+    """Supprime tout l'index (instantanés compris) sous le verrou d'écriture"""
+    with index_write_lock(index_dir):
+        if os.path.exists(index_dir):
+            shutil.rmtree(index_dir)
+    print("🧹 Index FAISS supprimé.")
+
+def process_document(file_path: str):
+    try:
+        return ingest_files([file_path])
     except Exception as e:
         print(f"❌ Erreur lors du traitement : {e}")
         return None
 
+def read_index_version(index_dir: str = INDEX_DIR):
+    """Retourne la version de l'index sur disque, None si absent"""
+    version, _ = current_index_path(index_dir)
+    return version
+
+def current_index_path(index_dir: str = INDEX_DIR):
+    """Retourne (version, dossier) du dernier instantané validé, (None, None) sinon"""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE)) as f:
+            version = f.read().strip()
+        return version, os.path.join(index_dir, version)
+    except FileNotFoundError:
+        pass
+    # Index créé avant les instantanés : fichiers à la racine, version = mtime
+    try:
+        return str(os.stat(os.path.join(index_dir, VECTORS_FILE)).st_mtime_ns), index_dir
+    except FileNotFoundError:
+        return None, None
+
+class EmbeddingModelMismatchError(ValueError):
+    """L'index a été construit avec un autre modèle d'embeddings que celui configuré"""
+
+def check_index_meta(snapshot_path: str, embeddings):
+    """Refuse un index construit avec un autre modèle d'embeddings"""
+    try:
+        with open(os.path.join(snapshot_path, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        print("⚠️ Index sans métadonnées : modèle d'embeddings non vérifié.")
+        return
+    if meta.get("embedding_model") != embeddings.model_name:
+        raise EmbeddingModelMismatchError(
+            f"Index construit avec '{meta.get('embedding_model')}', modèle configuré : "
+            f"'{embeddings.model_name}'. Réinitialisez les documents ou changez EMBEDDING_BACKEND."
+        )
+
+def load_snapshot(snapshot_path: str, embeddings, for_search: bool = False):
+    """Charge un instantané de l'index après vérification du modèle d'embeddings.
+
+    Avec `for_search`, les vecteurs sont mappés en mémoire si FAISS le permet
+    (voir read_vectors), les chunks lus à la demande, et l'index exact est remplacé par l'index approché de l'instantané
+    s'il existe (lecture seule : ne plus ajouter ni supprimer).
+    """
+    check_index_meta(snapshot_path, embeddings)
+    db = read_snapshot(snapshot_path, embeddings, for_search=for_search)
+    if for_search:
+        ann = load_ann_index(snapshot_path, db.index.ntotal)
+        if ann is not None:
+            db.index = ann
+    return db
+
+def load_vector_store_for_write(embeddings, index_dir: str = INDEX_DIR):
+    """Charge une copie privée (modifiable) du dernier instantané de l'index"""
+    _, path = current_index_path(index_dir)
+    if path is None:
+        return None
+    return load_snapshot(path, embeddings)
+
+def save_vector_store(db, manifest: dict, index_dir: str = INDEX_DIR) -> str:
+    """Sauvegarde atomique : nouvel instantané puis bascule du pointeur CURRENT.
+
+    Les lecteurs voient soit l'ancien instantané complet, soit le nouveau,
+    jamais un index à moitié écrit.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    _, previous_snapshot = current_index_path(index_dir)
+    version = str(time.time_ns())
+    snapshot = os.path.join(index_dir, version)
+    with stage("write_snapshot"):
+        write_snapshot(db, snapshot + ".tmp")
+    with open(os.path.join(snapshot + ".tmp", MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    with open(os.path.join(snapshot + ".tmp", META_FILE), "w", encoding="utf-8") as f:
+        json.dump({"embedding_model": db.embeddings.model_name, "dimension": db.index.d}, f)
+    with stage("ann_index"):
+        update_ann_index(db, snapshot + ".tmp", previous_snapshot)
+    with stage("bm25_index"):
+        update_bm25_index(db, snapshot + ".tmp", previous_snapshot)
+    os.replace(snapshot + ".tmp", snapshot)
+
+    tmp_path = os.path.join(index_dir, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(index_dir, CURRENT_FILE))
+
+    _remove_old_snapshots(index_dir, keep=KEEP_SNAPSHOTS)
+    return version
+
+def _remove_old_snapshots(index_dir: str, keep: int):
+    # Les anciens instantanés restent un moment pour les lecteurs en cours de chargement
+    snapshots = sorted(
+        (name for name in os.listdir(index_dir)
+         if name.isdigit() and os.path.isdir(os.path.join(index_dir, name))),
+        key=int
+    )
+    for name in snapshots[:-keep]:
+        shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+
+class VectorStoreManager:
+    """Garde une seule instance FAISS en mémoire, partagée par toutes les sessions.
+
+    L'index n'est rechargé que lorsque sa version sur disque change. Le nouvel
+    index est entièrement chargé avant de remplacer l'ancien, donc une requête
+    en cours garde toujours une instance complète.
+    """
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._store = None
+        self._version = None
+        self._snapshot_path = None
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def snapshot_path(self):
+        """Dossier de l'instantané actuellement chargé"""
+        return self._snapshot_path
+
+    def get(self):
+        version, path = current_index_path(self.index_dir)
+        if version is None:
+            if self._store is not None:
+                self.invalidate()
+            return None
+        if version == self._version:
+            return self._store
+
+        with self._lock:
+            # Un autre thread a pu recharger pendant l'attente du verrou
+            if version == self._version:
+                return self._store
+            print("📦 Chargement de la base FAISS existante...")
+            store = load_snapshot(path, get_embeddings(), for_search=True)
+            self._store, self._version, self._snapshot_path = store, version, path
+            return store
+
+    def invalidate(self):
+        with self._lock:
+            self._store, self._version, self._snapshot_path = None, None, None
+
+vector_store_manager = VectorStoreManager(INDEX_DIR)
+
 def get_vector_store():
-    embeddings = OpenAIEmbeddings()
-    if os.path.exists("faiss_index"):
-        print("📦 Chargement de la base FAISS existante...")
-        return FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-    print("⚠️ Aucune base FAISS trouvée.")
-    return None
+    """Retourne l'instance FAISS partagée (lecture seule), None si aucun index"""
+    store = vector_store_manager.get()
+    if store is None:
+        print("⚠️ Aucune base FAISS trouvée.")
+    return store
 
 # bach ykoun exportable dans app.py
 DOCS_DIR = DOCS_DIR
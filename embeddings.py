@@ -0,0 +1,208 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from openai_clients import embedding_model
+
+# Cache local des embeddings, partagé entre les ingestions et les réinitialisations
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite")
+
+# Backend d'embeddings : "openai" (API), "local" (modèle CPU hors ligne)
+# ou "hashing" (déterministe, sans modèle : tests et benchmarks)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+# Modèle local multilingue (nom Hugging Face ou dossier local), adapté aux cours en français
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "64"))
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", str(min(4, os.cpu_count() or 1))))
+# "onnx" pour l'inférence ONNX Runtime (sentence-transformers >= 3.2), sinon PyTorch
+LOCAL_EMBEDDING_RUNTIME = os.getenv("LOCAL_EMBEDDING_RUNTIME", "torch")
+
+# Nombre maximal de paramètres par requête SQLite (limite par défaut : 999)
+_SQL_BATCH = 500
+
+def normalize_text(text: str) -> str:
+    """Normalise un texte avant hachage (unicode NFC, espaces regroupés)"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+class EmbeddingCache:
+    """Cache persistant d'embeddings dans SQLite.
+
+    La clé est le hash du nom du modèle et du texte normalisé, la valeur un
+    vecteur float32 stocké en binaire.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: list) -> list:
+        """Retourne un vecteur (ou None si absent) pour chaque texte"""
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                found.update(rows)
+        results = [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+        hits = sum(result is not None for result in results)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model: str, texts: list, vectors: list):
+        rows = [
+            (self.make_key(model, text), model, np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+class CachedEmbeddings(Embeddings):
+    """Enveloppe un modèle d'embeddings : seuls les textes absents du cache sont calculés.
+
+    `model_name` identifie le backend et le modèle (ex. "openai:text-embedding-ada-002") ;
+    il sert de clé de cache et est enregistré dans les métadonnées de l'index.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, cache: EmbeddingCache):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts: list) -> list:
+        vectors = self.cache.get_many(self.model_name, texts)
+        # Un même texte manquant n'est envoyé qu'une fois
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, self.underlying.embed_documents(missing)))
+            self.cache.put_many(self.model_name, missing, [computed[text] for text in missing])
+            vectors = [computed[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+class LocalEmbeddings(Embeddings):
+    """Embeddings calculés localement sur CPU avec sentence-transformers.
+
+    Aucun appel réseau : le modèle doit être présent dans le cache Hugging Face
+    (ou `LOCAL_EMBEDDING_MODEL` pointe vers un dossier local). Les textes sont
+    encodés par lots, répartis sur un pool de threads.
+    """
+
+    def __init__(self, model_name: str = LOCAL_EMBEDDING_MODEL, batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE,
+                 threads: int = LOCAL_EMBEDDING_THREADS, runtime: str = LOCAL_EMBEDDING_RUNTIME):
+        # Import paresseux : dépendance optionnelle, lourde à charger
+        from sentence_transformers import SentenceTransformer
+
+        kwargs = {"backend": "onnx"} if runtime == "onnx" else {}
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device="cpu", **kwargs)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="local-embeddings")
+
+    def _encode(self, texts: list) -> list:
+        return self.model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True, show_progress_bar=False
+        ).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1:
+            return self._encode(texts)
+        return [vector for batch in self._pool.map(self._encode, batches) for vector in batch]
+
+    def embed_query(self, text: str) -> list:
+        return self._encode([text])[0]
+
+class HashingEmbeddings(Embeddings):
+    """Embeddings déterministes par hachage des mots (sac de mots normalisé).
+
+    Aucune qualité sémantique, mais deux textes qui partagent des mots sont
+    proches : suffisant pour mesurer la pipeline sans réseau ni modèle.
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def _embed(self, text: str) -> list:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in normalize_text(text).lower().split():
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
+
+def _create_backend():
+    """Retourne (modèle d'embeddings, identifiant du modèle) selon EMBEDDING_BACKEND"""
+    if EMBEDDING_BACKEND == "local":
+        return LocalEmbeddings(), f"local:{LOCAL_EMBEDDING_MODEL}"
+    if EMBEDDING_BACKEND == "hashing":
+        return HashingEmbeddings(), "hashing:384"
+    if EMBEDDING_BACKEND == "openai":
+        underlying = embedding_model()
+        return underlying, f"openai:{underlying.model}"
+    raise ValueError(f"Backend d'embeddings inconnu : {EMBEDDING_BACKEND}")
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings() -> CachedEmbeddings:
+    """Retourne le client d'embeddings partagé, adossé au cache persistant"""
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                underlying, model_id = _create_backend()
+                _embeddings = CachedEmbeddings(underlying, model_id, EmbeddingCache())
+    return _embeddings
+
+def embedding_cache_stats() -> dict:
+    """Compteurs hits/misses du cache d'embeddings depuis le démarrage du process"""
+    return get_embeddings().cache.stats()
@@ -0,0 +1,113 @@
+import json
+import os
+import sqlite3
+import threading
+
+import faiss
+from langchain.schema.document import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+# Fichiers d'un instantané : vecteurs FAISS bruts + chunks et métadonnées dans SQLite
+VECTORS_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+# Ancien format LangChain (docstore picklé), lu uniquement pour migrer
+LEGACY_DOCSTORE_FILE = "index.pkl"
+
+class SQLiteDocstore(Docstore):
+    """Docstore en lecture seule adossé à SQLite.
+
+    Les chunks ne sont pas chargés en mémoire : seul le contenu des résultats
+    d'une recherche (top-k) est lu, via la clé primaire. La connexion est ouverte
+    dès la création, elle reste donc valide si un instantané plus récent fait
+    supprimer ce fichier pendant que des requêtes l'utilisent encore.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def search(self, search: str):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT content, metadata FROM chunks WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+def read_vectors(path: str, mmap: bool):
+    """Lit un index FAISS, mappé en mémoire sans copie si la version de FAISS le permet"""
+    if mmap:
+        # IO_FLAG_MMAP_IFC (FAISS >= 1.9) : les vecteurs restent dans le fichier mappé,
+        # pages partagées entre les process et chargement quasi instantané.
+        # IO_FLAG_MMAP seul ne mappe que les listes inversées (IVF) : un IndexFlat
+        # serait copié entier en mémoire.
+        flags = [getattr(faiss, "IO_FLAG_MMAP_IFC", None), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY]
+        for flag in flags:
+            if flag is None:
+                continue
+            try:
+                return faiss.read_index(path, flag)
+            except RuntimeError:
+                # Type d'index sans support de ce mode dans cette version de FAISS
+                continue
+    return faiss.read_index(path)
+
+def _read_positions(conn) -> dict:
+    return dict(conn.execute("SELECT position, id FROM chunks ORDER BY position"))
+
+def write_snapshot(db, snapshot_path: str):
+    """Écrit l'index FAISS et un docstore SQLite (sans pickle) dans un instantané"""
+    os.makedirs(snapshot_path, exist_ok=True)
+    faiss.write_index(db.index, os.path.join(snapshot_path, VECTORS_FILE))
+
+    conn = sqlite3.connect(os.path.join(snapshot_path, DOCSTORE_FILE))
+    try:
+        conn.execute(
+            "CREATE TABLE chunks (id TEXT PRIMARY KEY, position INTEGER NOT NULL UNIQUE, "
+            "content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        rows = []
+        for position, doc_id in db.index_to_docstore_id.items():
+            doc = db.docstore.search(doc_id)
+            rows.append((doc_id, position, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)))
+        conn.executemany("INSERT INTO chunks (id, position, content, metadata) VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+def read_snapshot(snapshot_path: str, embeddings, for_search: bool = False):
+    """Charge un instantané.
+
+    Avec `for_search` (lecteurs), les vecteurs sont mappés en mémoire sans copie
+    (FAISS >= 1.9, sinon lus en mémoire) et les chunks lus à la demande depuis SQLite. Sinon (écrivain), on
+    charge une copie modifiable complète en mémoire.
+    """
+    docstore_path = os.path.join(snapshot_path, DOCSTORE_FILE)
+    if not os.path.exists(docstore_path) and os.path.exists(os.path.join(snapshot_path, LEGACY_DOCSTORE_FILE)):
+        print("⚠️ Ancien format d'index (pickle) : migration à la prochaine sauvegarde.")
+        return FAISS.load_local(snapshot_path, embeddings, allow_dangerous_deserialization=True)
+
+    index = read_vectors(os.path.join(snapshot_path, VECTORS_FILE), mmap=for_search)
+    if for_search:
+        docstore = SQLiteDocstore(docstore_path)
+        index_to_docstore_id = _read_positions(docstore.conn)
+    else:
+        conn = sqlite3.connect(docstore_path)
+        try:
+            index_to_docstore_id = _read_positions(conn)
+            docstore = InMemoryDocstore({
+                doc_id: Document(page_content=content, metadata=json.loads(metadata))
+                for doc_id, content, metadata in conn.execute("SELECT id, content, metadata FROM chunks")
+            })
+        finally:
+            conn.close()
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
@@ -0,0 +1,167 @@
+import json
+import os
+import sqlite3
+import time
+
+# File d'attente persistante des travaux d'indexation (partagée entre l'app et le worker)
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(os.getenv("CACHE_DIR", "cache"), "jobs.sqlite"))
+
+# Types de travaux exécutés par worker.py
+JOB_INGEST = "ingest"
+JOB_REMOVE = "remove"
+JOB_RESET = "reset"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    index_dir TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker_pid INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    path TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    n_chunks INTEGER,
+    error TEXT,
+    PRIMARY KEY (job_id, path)
+);
+"""
+
+def _connect(path: str = None):
+    path = path or JOBS_DB_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # isolation_level=None : transactions explicites (BEGIN IMMEDIATE pour réserver un travail)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+def enqueue(kind: str, file_paths: list, index_dir: str) -> int:
+    """Ajoute un travail à la file, retourne son identifiant"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        job_id = conn.execute(
+            "INSERT INTO jobs (kind, index_dir, created_at) VALUES (?, ?, ?)",
+            (kind, index_dir, time.time())
+        ).lastrowid
+        conn.executemany(
+            "INSERT OR IGNORE INTO job_files (job_id, path) VALUES (?, ?)",
+            [(job_id, path) for path in file_paths]
+        )
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    print(f"📥 Travail #{job_id} ({kind}) ajouté à la file : {len(file_paths)} fichier(s).")
+    return job_id
+
+def claim_next_job(worker_pid: int):
+    """Réserve le plus ancien travail en attente pour ce worker, None si la file est vide"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ? WHERE id = ?",
+            (worker_pid, time.time(), row["id"])
+        )
+        files = [r["path"] for r in conn.execute(
+            "SELECT path FROM job_files WHERE job_id = ? ORDER BY rowid", (row["id"],)
+        )]
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return {"id": row["id"], "kind": row["kind"], "index_dir": row["index_dir"], "files": files}
+
+def update_file(job_id: int, path: str, status: str, n_chunks: int = None, error: str = None):
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE job_files SET status = ?, n_chunks = ?, error = ? WHERE job_id = ? AND path = ?",
+            (status, n_chunks, error, job_id, path)
+        )
+    finally:
+        conn.close()
+
+def commit_files(job_id: int):
+    """Fichiers analysés ('parsed') d'un travail : désormais enregistrés dans l'index"""
+    conn = _connect()
+    try:
+        conn.execute("UPDATE job_files SET status = 'done' WHERE job_id = ? AND status = 'parsed'", (job_id,))
+    finally:
+        conn.close()
+
+def finish_job(job_id: int, error: str = None):
+    """Termine un travail : 'failed' s'il a échoué, 'partial' si certains fichiers ont échoué, sinon 'done'"""
+    conn = _connect()
+    try:
+        if error:
+            # Rien n'a été enregistré dans l'index, y compris pour les fichiers déjà analysés
+            conn.execute(
+                "UPDATE job_files SET status = 'failed', error = ? WHERE job_id = ? AND status IN ('queued', 'parsed')",
+                (error, job_id)
+            )
+            status = "failed"
+        else:
+            failed = [os.path.basename(row["path"]) for row in conn.execute(
+                "SELECT path FROM job_files WHERE job_id = ? AND status = 'failed' ORDER BY rowid", (job_id,)
+            )]
+            status = "partial" if failed else "done"
+            if failed:
+                error = f"{len(failed)} fichier(s) en échec : {', '.join(failed)}"
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id)
+        )
+    finally:
+        conn.close()
+    return status
+
+def requeue_interrupted_jobs() -> int:
+    """Remet en attente les travaux d'un worker arrêté en cours de route (crash, redémarrage)"""
+    conn = _connect()
+    try:
+        count = conn.execute(
+            "UPDATE jobs SET status = 'queued', worker_pid = NULL, started_at = NULL WHERE status = 'running'"
+        ).rowcount
+        conn.execute(
+            "UPDATE job_files SET status = 'queued', n_chunks = NULL, error = NULL "
+            "WHERE job_id IN (SELECT id FROM jobs WHERE status = 'queued')"
+        )
+    finally:
+        conn.close()
+    if count:
+        print(f"🔁 {count} travail(aux) interrompu(s) remis en attente.")
+    return count
+
+def list_jobs(limit: int = 10, active_only: bool = False) -> list:
+    """Derniers travaux avec l'avancement de chaque fichier (pour l'interface)"""
+    conn = _connect()
+    try:
+        where = "WHERE status IN ('queued', 'running')" if active_only else ""
+        jobs = [dict(row) for row in conn.execute(
+            f"SELECT * FROM jobs {where} ORDER BY id DESC LIMIT ?", (limit,)
+        )]
+        for job in jobs:
+            job["files"] = [dict(row) for row in conn.execute(
+                "SELECT path, status, n_chunks, error FROM job_files WHERE job_id = ? ORDER BY rowid",
+                (job["id"],)
+            )]
+            job["done"] = sum(f["status"] in ("done", "failed") for f in job["files"])
+    finally:
+        conn.close()
+    return jobs
+
+if __name__ == "__main__":
+    print(json.dumps(list_jobs(limit=20), indent=2, ensure_ascii=False))
@@ -0,0 +1,185 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain.schema.document import Document
+
+# Langue(s) Tesseract, ex. "fra+eng" si le pack français est installé
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Résolution du rendu des pages PDF scannées et côté maximal des images avant OCR
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2200"))
+# En dessous de ce nombre de caractères, une page PDF avec images est considérée comme scannée
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "20"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+# Pages scannées rendues en attente d'OCR (par PDF)
+OCR_MAX_IN_FLIGHT = int(os.getenv("OCR_MAX_IN_FLIGHT", str(2 * OCR_WORKERS)))
+OCR_CACHE_PATH = os.path.join(os.getenv("CACHE_DIR", "cache"), "ocr.sqlite")
+# Change dès que le prétraitement change : invalide les anciennes entrées du cache
+_PREPROCESS_VERSION = "v1"
+
+def _otsu_threshold(histogram: list) -> int:
+    """Seuil de binarisation qui maximise la variance inter-classes (méthode d'Otsu)"""
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background, weight_background = 0.0, 0
+    best_threshold, best_variance = 127, 0.0
+    for threshold, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += threshold * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = threshold, variance
+    return best_threshold
+
+def preprocess_image(img):
+    """Niveaux de gris, réduction à OCR_MAX_SIDE puis binarisation"""
+    from PIL import Image
+
+    img = img.convert("L")
+    if max(img.size) > OCR_MAX_SIDE:
+        img.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE), Image.LANCZOS)
+    threshold = _otsu_threshold(img.histogram())
+    return img.point(lambda value: 255 if value > threshold else 0, mode="1")
+
+def _ocr_image_bytes(image_bytes: bytes) -> str:
+    # Exécuté dans un process du pool : imports locaux, rien de partagé
+    import pytesseract
+    from PIL import Image
+
+    img = preprocess_image(Image.open(io.BytesIO(image_bytes)))
+    return pytesseract.image_to_string(img, lang=OCR_LANG)
+
+class OCRCache:
+    """Texte OCR par hash de l'image de la page (SQLite)"""
+
+    def __init__(self, path: str = OCR_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(image_bytes: bytes) -> str:
+        digest = hashlib.sha256(image_bytes)
+        digest.update(f"\0{OCR_LANG}\0{OCR_MAX_SIDE}\0{_PREPROCESS_VERSION}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM ocr WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, text: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO ocr (key, text) VALUES (?, ?)", (key, text))
+            self._conn.commit()
+
+_pool = None
+_cache = None
+_init_lock = threading.Lock()
+
+def _get_pool_and_cache():
+    global _pool, _cache
+    if _pool is None:
+        with _init_lock:
+            if _pool is None:
+                # "spawn" : pas de fork d'un process multi-threadé (Streamlit)
+                _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+                _cache = OCRCache()
+    return _pool, _cache
+
+class _CachedText:
+    """Résultat déjà connu, même interface qu'un Future"""
+
+    def __init__(self, text: str):
+        self._text = text
+
+    def result(self):
+        return self._text
+
+def submit_ocr(image_bytes: bytes):
+    """Lance l'OCR d'une image dans le pool (ou la lit dans le cache), retourne un Future"""
+    pool, cache = _get_pool_and_cache()
+    key = OCRCache.make_key(image_bytes)
+    text = cache.get(key)
+    if text is not None:
+        return _CachedText(text)
+    future = pool.submit(_ocr_image_bytes, image_bytes)
+    future.add_done_callback(lambda f: f.exception() is None and cache.put(key, f.result()))
+    return future
+
+def ocr_image_file(file_path: str) -> list:
+    """OCR d'un fichier image, retourne une liste [Document]"""
+    with open(file_path, "rb") as f:
+        text = submit_ocr(f.read()).result()
+    if not text.strip():
+        print(f"❗ Aucun texte détecté dans l'image : {file_path}")
+        return []
+    print(f"🧾 Texte extrait de l'image ({len(text)} caractères)")
+    return [Document(page_content=text, metadata={"source": file_path, "ocr": True})]
+
+def extract_pdf(file_path: str) -> list:
+    """Extrait un PDF page par page ; les pages scannées (images sans texte) passent par l'OCR.
+
+    Les pages texte sont lues directement pendant que les pages scannées sont
+    OCRisées en parallèle dans le pool ; l'ordre des pages est conservé. Au plus
+    OCR_MAX_IN_FLIGHT pages attendent leur OCR : les images rendues ne
+    s'accumulent pas en mémoire sur un gros recueil scanné.
+    """
+    import fitz
+
+    documents = []
+    pending = deque()
+    n_ocr, in_flight = 0, 0
+
+    def collect():
+        nonlocal in_flight
+        result, metadata = pending.popleft()
+        if metadata.get("ocr"):
+            in_flight -= 1
+        try:
+            text = result.result()
+        except Exception as e:
+            print(f"❌ Erreur OCR page {metadata['page']} de {file_path} : {e}")
+            return
+        if text.strip():
+            documents.append(Document(page_content=text, metadata=metadata))
+
+    with fitz.open(file_path) as pdf:
+        total_pages = pdf.page_count
+        for page in pdf:
+            metadata = {"source": file_path, "file_path": file_path, "page": page.number, "total_pages": total_pages}
+            text = page.get_text()
+            if len(text.strip()) < OCR_MIN_TEXT_CHARS and page.get_images():
+                png = page.get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY).tobytes("png")
+                pending.append((submit_ocr(png), {**metadata, "ocr": True}))
+                n_ocr += 1
+                in_flight += 1
+            else:
+                pending.append((_CachedText(text), metadata))
+            # Résultats récupérés dans l'ordre des pages dès que la limite est atteinte
+            while in_flight > OCR_MAX_IN_FLIGHT:
+                collect()
+            while pending and not pending[0][1].get("ocr"):
+                collect()
+
+    while pending:
+        collect()
+    if n_ocr:
+        print(f"🧾 {n_ocr} page(s) scannée(s) passée(s) par l'OCR : {file_path}")
+    return documents
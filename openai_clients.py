@@ -0,0 +1,42 @@
+import os
+
+import httpx
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+# Pool de connexions HTTP keep-alive partagé par tous les clients OpenAI du process
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# "openai" ou "fake" (réponse fixe, sans réseau : tests et benchmarks)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+FAKE_LLM_RESPONSE = os.getenv("FAKE_LLM_RESPONSE", "## Réponse de test\n\n- Contenu déterministe.")
+# Permet de pointer vers un serveur compatible OpenAI (ex. stub_openai_server.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+_limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+http_client = httpx.Client(limits=_limits, timeout=HTTP_TIMEOUT)
+http_async_client = httpx.AsyncClient(limits=_limits, timeout=HTTP_TIMEOUT)
+
+def chat_model(model_name: str, temperature: float, max_retries: int = OPENAI_MAX_RETRIES):
+    """Client de chat adossé au pool HTTP partagé ; `max_retries=0` si l'appelant gère ses propres retries"""
+    if LLM_BACKEND == "fake":
+        return FakeListChatModel(responses=[FAKE_LLM_RESPONSE])
+    return ChatOpenAI(
+        model_name=model_name,
+        temperature=temperature,
+        base_url=OPENAI_BASE_URL,
+        max_retries=max_retries,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+
+def embedding_model() -> OpenAIEmbeddings:
+    """Client d'embeddings adossé au pool HTTP partagé"""
+    return OpenAIEmbeddings(
+        base_url=OPENAI_BASE_URL,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
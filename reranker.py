@@ -0,0 +1,162 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+from langchain.schema import BaseRetriever
+
+from embeddings import get_embeddings, normalize_text
+from tokenizer import count_tokens
+from tracing import increment, record, stage
+
+# Second étage de la recherche : "cross-encoder" (modèle CPU local), "mmr" (diversité) ou "off"
+RERANK_MODE = os.getenv("RERANK_MODE", "mmr")
+# Candidats récupérés (peu coûteux) avant le re-classement
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+# Cross-encoder multilingue (cours en français), ~120 Mo
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+# 1 = pertinence seule, 0 = diversité seule
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Part du rang du premier étage (fusion BM25 + vecteurs) dans la pertinence MMR, le reste : cosinus
+MMR_RANK_WEIGHT = float(os.getenv("MMR_RANK_WEIGHT", "0.5"))
+# Budget de tokens des extraits envoyés à combine_docs_prompt
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+
+class ScoreCache:
+    """Scores du cross-encoder par (question, chunk), en mémoire avec éviction LRU"""
+
+    def __init__(self, max_entries: int = RERANK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(query: str, text: str) -> str:
+        return hashlib.sha256(f"{normalize_text(query).lower()}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, query: str, texts: list) -> list:
+        keys = [self.make_key(query, text) for text in texts]
+        with self._lock:
+            scores = [self._entries.get(key) for key in keys]
+            for key, score in zip(keys, scores):
+                if score is not None:
+                    self._entries.move_to_end(key)
+        return scores
+
+    def put_many(self, query: str, texts: list, scores: list):
+        with self._lock:
+            for text, score in zip(texts, scores):
+                self._entries[self.make_key(query, text)] = score
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+score_cache = ScoreCache()
+
+_cross_encoder = None
+_cross_encoder_missing = False
+_cross_encoder_lock = threading.Lock()
+
+def get_cross_encoder():
+    """Charge le cross-encoder au premier re-classement (import lourd)"""
+    global _cross_encoder
+    if _cross_encoder is None:
+        with _cross_encoder_lock:
+            if _cross_encoder is None:
+                from sentence_transformers import CrossEncoder
+
+                print(f"🧠 Chargement du cross-encoder {CROSS_ENCODER_MODEL}...")
+                _cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL, device="cpu")
+    return _cross_encoder
+
+def cross_encoder_rerank(query: str, docs: list, top_n: int) -> list:
+    """Classe les candidats par score du cross-encoder, calculé par lots et mis en cache"""
+    texts = [doc.page_content for doc in docs]
+    scores = score_cache.get_many(query, texts)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        model = get_cross_encoder()
+        with stage("rerank_model"):
+            computed = model.predict([(query, texts[i]) for i in missing], batch_size=RERANK_BATCH_SIZE)
+        for i, score in zip(missing, computed):
+            scores[i] = float(score)
+        score_cache.put_many(query, [texts[i] for i in missing], [scores[i] for i in missing])
+    record("rerank_cache_hits", len(docs) - len(missing))
+    increment("cache", "rerank_hit", len(docs) - len(missing))
+    increment("cache", "rerank_miss", len(missing))
+    order = np.argsort(scores)[::-1][:top_n]
+    return [docs[i] for i in order]
+
+def mmr_rerank(query: str, docs: list, top_n: int, lambda_mult: float = MMR_LAMBDA,
+               rank_weight: float = MMR_RANK_WEIGHT) -> list:
+    """Maximal Marginal Relevance : pertinence pour la question moins redondance avec les chunks déjà choisis.
+
+    `docs` arrive dans l'ordre du premier étage. La pertinence mélange ce rang
+    et le cosinus : un chunk trouvé par BM25 seul (acronyme exact, sous le
+    seuil vectoriel) garde sa place au lieu de passer après tous les résultats vectoriels.
+    """
+    embeddings = get_embeddings()
+    # Vecteurs des chunks et de la question : déjà dans le cache d'embeddings (ingestion, recherche)
+    vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in docs]), dtype=np.float32)
+    query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+    query_vector /= np.linalg.norm(query_vector) + 1e-12
+
+    cosine = vectors @ query_vector
+    # Les deux termes ramenés à [0, 1] sur les candidats
+    cosine = (cosine - cosine.min()) / (cosine.max() - cosine.min() + 1e-12)
+    rank_relevance = 1.0 - np.arange(len(docs), dtype=np.float32) / len(docs)
+    relevance = rank_weight * rank_relevance + (1 - rank_weight) * cosine
+    similarity = vectors @ vectors.T
+    selected = []
+    redundancy = np.zeros(len(docs), dtype=np.float32)
+    for _ in range(min(top_n, len(docs))):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, similarity[:, best])
+    return [docs[i] for i in selected]
+
+def rerank(query: str, docs: list, top_n: int, mode: str = RERANK_MODE) -> list:
+    """Retourne les `top_n` meilleurs candidats selon `mode`"""
+    global _cross_encoder_missing
+    if len(docs) <= 1 or mode == "off":
+        return docs[:top_n]
+    if mode == "cross-encoder" and not _cross_encoder_missing:
+        try:
+            return cross_encoder_rerank(query, docs, top_n)
+        except ImportError:
+            print("⚠️ sentence-transformers absent : re-classement MMR à la place du cross-encoder.")
+            _cross_encoder_missing = True
+    return mmr_rerank(query, docs, top_n)
+
+def trim_to_token_budget(docs: list, max_tokens: int = CONTEXT_MAX_TOKENS) -> list:
+    """Garde les meilleurs chunks tant que le budget de tokens le permet (au moins un)"""
+    kept, used = [], 0
+    for doc in docs:
+        tokens = count_tokens(doc.page_content)
+        if kept and used + tokens > max_tokens:
+            break
+        kept.append(doc)
+        used += tokens
+    record("context_tokens", used)
+    return kept
+
+class RerankingRetriever(BaseRetriever):
+    """Recherche en deux étages : `base` sur-échantillonne, puis re-classement et budget de tokens"""
+
+    base: Any
+    top_n: int
+    mode: str = RERANK_MODE
+    max_tokens: int = CONTEXT_MAX_TOKENS
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> list:
+        candidates = self.base.invoke(query)
+        with stage("rerank"):
+            docs = rerank(query, candidates, self.top_n, self.mode)
+        record("rerank_candidates", len(candidates))
+        return trim_to_token_budget(docs, self.max_tokens)
@@ -0,0 +1,172 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import numpy as np
+from langchain.schema import BaseRetriever
+from langchain.schema.document import Document
+
+from bm25_index import BM25Index
+from reranker import RERANK_CANDIDATES, RERANK_MODE, RerankingRetriever, rerank, trim_to_token_budget
+from tracing import stage
+
+# "hybrid" (BM25 + vecteurs fusionnés) ou "vector" (vecteurs seuls)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Nombre de chunks envoyés au LLM et score de pertinence vectorielle minimal
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "3"))
+RETRIEVER_SCORE_THRESHOLD = float(os.getenv("RETRIEVER_SCORE_THRESHOLD", "0.7"))
+# Candidats récupérés par chaque méthode avant fusion
+RETRIEVER_FETCH_K = int(os.getenv("RETRIEVER_FETCH_K", "20"))
+# Constante de la fusion par rang réciproque (valeur usuelle : 60)
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Recherches simultanées dans plusieurs collections
+MAX_PARALLEL_COLLECTIONS = int(os.getenv("MAX_PARALLEL_COLLECTIONS", "8"))
+
+_fanout_pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL_COLLECTIONS, thread_name_prefix="collections")
+
+def reciprocal_rank_fusion(rankings: list, rrf_k: int = RRF_K, with_scores: bool = False) -> list:
+    """Fusionne des listes d'identifiants classées : score = somme de 1 / (rrf_k + rang)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [(doc_id, scores[doc_id]) for doc_id in ranked] if with_scores else ranked
+
+class HybridRetriever(BaseRetriever):
+    """Recherche vectorielle FAISS et lexicale BM25, fusionnées par rang réciproque.
+
+    Le seuil de pertinence ne s'applique qu'aux résultats vectoriels : un
+    acronyme exact (DHCP, APIPA...) mal placé en similarité sémantique reste
+    trouvé par BM25. Sans index BM25, seuls les résultats vectoriels comptent.
+    """
+
+    vector_store: Any
+    bm25: Any = None
+    k: int = RETRIEVER_K
+    score_threshold: float = RETRIEVER_SCORE_THRESHOLD
+    fetch_k: int = RETRIEVER_FETCH_K
+
+    def vector_search(self, query: str) -> list:
+        """Retourne [(chunk_id, pertinence)] au-dessus du seuil, par pertinence décroissante"""
+        return self.vector_search_batch([query])[0]
+
+    def vector_search_batch(self, queries: list) -> list:
+        """vector_search pour plusieurs questions : un seul appel d'embedding et une seule recherche FAISS"""
+        vs = self.vector_store
+        with stage("embed_query"):
+            embeddings = np.asarray(vs.embeddings.embed_documents(queries), dtype=np.float32)
+        with stage("vector_search"):
+            distances, positions = vs.index.search(embeddings, self.fetch_k)
+        relevance_fn = vs._select_relevance_score_fn()
+        batch_results = []
+        for query_distances, query_positions in zip(distances, positions):
+            results = []
+            for distance, position in zip(query_distances, query_positions):
+                if position == -1:
+                    continue
+                relevance = relevance_fn(float(distance))
+                if relevance >= self.score_threshold:
+                    results.append((vs.index_to_docstore_id[int(position)], relevance))
+            batch_results.append(results)
+        return batch_results
+
+    def ranked_ids(self, query: str) -> list:
+        """Retourne les k meilleurs [(chunk_id, score RRF)] après fusion"""
+        return self.ranked_ids_batch([query])[0]
+
+    def ranked_ids_batch(self, queries: list) -> list:
+        """ranked_ids pour plusieurs questions (recherche vectorielle groupée)"""
+        batch_rankings = []
+        for query, vector_results in zip(queries, self.vector_search_batch(queries)):
+            rankings = [[chunk_id for chunk_id, _ in vector_results]]
+            if self.bm25 is not None:
+                with stage("bm25_search"):
+                    rankings.append([chunk_id for chunk_id, _ in self.bm25.search(query, self.fetch_k)])
+            batch_rankings.append(reciprocal_rank_fusion(rankings, with_scores=True)[:self.k])
+        return batch_rankings
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> list:
+        return [self.vector_store.docstore.search(chunk_id) for chunk_id, _ in self.ranked_ids(query)]
+
+class MultiCollectionRetriever(BaseRetriever):
+    """Interroge plusieurs collections en parallèle et garde les k meilleurs chunks.
+
+    Les scores RRF ont la même échelle dans chaque collection : le top-k
+    fusionné est un simple tri. Chaque document indique sa collection.
+    """
+
+    retrievers: dict
+    k: int = RETRIEVER_K
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> list:
+        # copy_context : les étapes des threads restent dans la trace de la requête
+        futures = {
+            name: _fanout_pool.submit(contextvars.copy_context().run, retriever.ranked_ids, query)
+            for name, retriever in self.retrievers.items()
+        }
+        return _merge_collections(
+            self.retrievers, {name: future.result() for name, future in futures.items()}, self.k
+        )
+
+def _merge_collections(retrievers: dict, ranked_by_collection: dict, k: int) -> list:
+    """Top-k fusionné de plusieurs collections, chaque document indique sa collection"""
+    scored = [
+        (score, name, chunk_id)
+        for name, ranked in ranked_by_collection.items()
+        for chunk_id, score in ranked
+    ]
+    scored.sort(key=lambda item: item[0], reverse=True)
+    documents = []
+    for _, name, chunk_id in scored[:k]:
+        doc = retrievers[name].vector_store.docstore.search(chunk_id)
+        documents.append(Document(page_content=doc.page_content, metadata={**doc.metadata, "collection": name}))
+    return documents
+
+def build_retriever(vector_store, snapshot_path: str = None, k: int = RETRIEVER_K) -> HybridRetriever:
+    """Retriever de la pipeline : hybride si l'instantané a un index BM25"""
+    bm25 = BM25Index.open(snapshot_path) if RETRIEVAL_MODE == "hybrid" else None
+    # Chaque méthode ramène au moins k candidats (sur-échantillonnage du re-classement)
+    return HybridRetriever(vector_store=vector_store, bm25=bm25, k=k, fetch_k=max(RETRIEVER_FETCH_K, k))
+
+def build_collections_retriever(stores: dict) -> BaseRetriever:
+    """Retriever sur une ou plusieurs collections : {nom: (vector_store, snapshot_path)}.
+
+    Avec le re-classement, chaque recherche ramène RERANK_CANDIDATES candidats ;
+    seuls les RETRIEVER_K meilleurs, dans le budget de tokens, vont au LLM.
+    """
+    k = RERANK_CANDIDATES if RERANK_MODE != "off" else RETRIEVER_K
+    if len(stores) == 1:
+        (vector_store, snapshot_path), = stores.values()
+        base = build_retriever(vector_store, snapshot_path, k)
+    else:
+        base = MultiCollectionRetriever(k=k, retrievers={
+            name: build_retriever(vector_store, snapshot_path, k)
+            for name, (vector_store, snapshot_path) in stores.items()
+        })
+    return RerankingRetriever(base=base, top_n=RETRIEVER_K)
+
+def batch_retrieve(stores: dict, queries: list) -> list:
+    """Documents de contexte pour une liste de questions (mode hors ligne).
+
+    Même résultat que le retriever de build_collections_retriever pour chaque
+    question, mais avec un seul embedding par lot et une seule recherche FAISS
+    matricielle par collection.
+    """
+    k = RERANK_CANDIDATES if RERANK_MODE != "off" else RETRIEVER_K
+    retrievers = {
+        name: build_retriever(vector_store, snapshot_path, k) for name, (vector_store, snapshot_path) in stores.items()
+    }
+    ranked = {name: retriever.ranked_ids_batch(queries) for name, retriever in retrievers.items()}
+    results = []
+    for i, query in enumerate(queries):
+        if len(retrievers) == 1:
+            (name, retriever), = retrievers.items()
+            candidates = [retriever.vector_store.docstore.search(chunk_id) for chunk_id, _ in ranked[name][i]]
+        else:
+            candidates = _merge_collections(retrievers, {name: ranked[name][i] for name in retrievers}, k)
+        with stage("rerank"):
+            docs = rerank(query, candidates, RETRIEVER_K)
+        results.append(trim_to_token_budget(docs))
+    return results
@@ -0,0 +1,116 @@
+"""Serveur local minimal compatible OpenAI, pour tester sans réseau ni clé.
+
+Usage :
+    python stub_openai_server.py --port 8001
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub streamlit run app.py
+
+Les embeddings sont déterministes (dérivés d'un hash du texte) et les réponses
+de chat renvoient la dernière question reçue, éventuellement en streaming.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+EMBEDDING_DIM = 1536
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> list:
+    """Vecteur unitaire déterministe pour un texte"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Latence simulée par requête (secondes)
+    latency = 0.0
+    # Prochaines requêtes de chat servies en erreur 500 (tests des retries) et compteur de requêtes
+    fail_next = 0
+    chat_requests = 0
+    _counter_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.latency)
+        if self.path.endswith("/embeddings"):
+            inputs = request["input"]
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self._send_json({
+                "object": "list",
+                "model": request.get("model", "stub"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(str(text))}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+        elif self.path.endswith("/chat/completions"):
+            self._chat_completion(request)
+        else:
+            self.send_error(404)
+
+    def _chat_completion(self, request: dict):
+        with self._counter_lock:
+            StubOpenAIHandler.chat_requests += 1
+            fail = StubOpenAIHandler.fail_next > 0
+            if fail:
+                StubOpenAIHandler.fail_next -= 1
+        if fail:
+            self.send_error(500, "Erreur simulée")
+            return
+        question = request["messages"][-1]["content"] if request.get("messages") else ""
+        answer = f"Réponse de test : {question[-200:]}"
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": request.get("model", "stub")}
+
+        if not request.get("stream"):
+            self._send_json({
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": answer}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for word in answer.split(" "):
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        final = {**base, "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.close_connection = True
+
+def serve(host: str = "127.0.0.1", port: int = 8001, latency: float = 0.0) -> ThreadingHTTPServer:
+    StubOpenAIHandler.latency = latency
+    return ThreadingHTTPServer((host, port), StubOpenAIHandler)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latence simulée par requête (s)")
+    args = parser.parse_args()
+    server = serve(args.host, args.port, args.latency)
+    print(f"🧪 Serveur OpenAI factice sur http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# Backends sans réseau (LLM factice, embeddings par hachage) et caches temporaires,
+# à définir avant l'import des modules du projet (configuration lue à l'import)
+_WORKDIR = tempfile.mkdtemp(prefix="schoolify-tests-")
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+os.environ["CACHE_DIR"] = os.path.join(_WORKDIR, "cache")
+os.environ["INDEX_DIR"] = os.path.join(_WORKDIR, "faiss_index")
+os.environ["JOBS_DB_PATH"] = os.path.join(_WORKDIR, "cache", "jobs.sqlite")
+os.environ["COLLECTIONS_DIR"] = os.path.join(_WORKDIR, "collections")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
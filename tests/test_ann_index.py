@@ -0,0 +1,36 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+import ann_index
+from ann_index import ANN_META_FILE, build_index_from, load_ann_index, update_ann_index, usable_index_type
+
+def _flat(n_vectors: int, dimension: int = 32):
+    index = faiss.IndexFlatL2(dimension)
+    index.add(np.random.default_rng(0).normal(size=(n_vectors, dimension)).astype(np.float32))
+    return index
+
+def test_small_corpus_falls_back_from_ivf_pq():
+    assert usable_index_type("ivf_pq", 40) == "hnsw"
+    assert usable_index_type("ivf_flat", 10) == "hnsw"
+    assert usable_index_type("ivf_flat", 5000) == "ivf_flat"
+
+def test_ivf_pq_on_40_vectors_still_writes_an_index(tmp_path, monkeypatch):
+    flat = _flat(40)
+    db = SimpleNamespace(index=flat, index_to_docstore_id={i: f"id-{i}" for i in range(40)})
+    monkeypatch.setattr(ann_index, "choose_index_type", lambda n: "ivf_pq")
+    assert update_ann_index(db, str(tmp_path)) == "hnsw"
+    assert os.path.exists(tmp_path / ANN_META_FILE)
+    assert load_ann_index(str(tmp_path), 40).ntotal == 40
+
+def test_build_from_flat_trains_on_a_sample(monkeypatch):
+    monkeypatch.setattr(ann_index, "ANN_ADD_BATCH", 700)
+    flat = _flat(3000)
+    index = build_index_from(flat, "ivf_flat")
+    assert index.ntotal == 3000
+    _, positions = index.search(flat.reconstruct_n(0, 5), 1)
+    assert positions[:, 0].tolist() == [0, 1, 2, 3, 4]
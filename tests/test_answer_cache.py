@@ -0,0 +1,23 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from answer_cache import SemanticAnswerCache
+from embeddings import get_embeddings
+
+def test_miss_then_retrieval_embeds_the_question_once():
+    embeddings = get_embeddings()
+    cache = SemanticAnswerCache(embeddings)
+    question = "C'est quoi le protocole DHCP ?"
+    misses_before = embeddings.cache.misses
+
+    assert cache.get(question, "v1") is None
+    # Recherche vectorielle sur la même question (HybridRetriever.vector_search_batch)
+    embeddings.embed_documents([question])
+    assert embeddings.cache.misses - misses_before == 1
+
+def test_put_then_get_same_question():
+    cache = SemanticAnswerCache(get_embeddings())
+    cache.put("Qu'est-ce que APIPA ?", "v1", {"answer": "Adressage automatique", "source_documents": []})
+    assert cache.get("Qu'est-ce que APIPA ?", "v1")["answer"] == "Adressage automatique"
+    assert cache.get("Qu'est-ce que APIPA ?", "v2") is None
@@ -0,0 +1,50 @@
+import threading
+from concurrent.futures import wait
+
+import pytest
+
+pytest.importorskip("langchain_openai")
+
+from langchain.schema import HumanMessage
+
+import openai_clients
+from async_engine import AsyncQAEngine
+from stub_openai_server import StubOpenAIHandler, serve
+
+@pytest.fixture
+def stub_url(monkeypatch):
+    server = serve(port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(StubOpenAIHandler, "chat_requests", 0)
+    monkeypatch.setattr(StubOpenAIHandler, "fail_next", 0)
+    # Clients du moteur vers le serveur factice (construits dans AsyncQAEngine.__init__)
+    monkeypatch.setattr(openai_clients, "LLM_BACKEND", "openai")
+    monkeypatch.setattr(openai_clients, "OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    yield
+    server.shutdown()
+
+def test_identical_questions_are_coalesced(stub_url, monkeypatch):
+    monkeypatch.setattr(StubOpenAIHandler, "latency", 0.3)
+    engine = AsyncQAEngine()
+    futures = [engine.submit(engine.aask("C'est quoi DHCP ?", [])) for _ in range(3)]
+    done, _ = wait(futures, timeout=10)
+    answers = {future.result()["answer"] for future in done}
+    assert len(done) == 3 and len(answers) == 1
+    assert StubOpenAIHandler.chat_requests == 1
+
+def test_server_error_is_retried(stub_url, monkeypatch):
+    monkeypatch.setattr(StubOpenAIHandler, "fail_next", 1)
+    engine = AsyncQAEngine(backoff=0.01)
+    response = engine.submit(engine.agenerate([HumanMessage(content="Bonjour")])).result(timeout=10)
+    assert "Bonjour" in response.content
+    # Une erreur 500 puis un succès : pas de retries internes du client en plus de ceux du moteur
+    assert StubOpenAIHandler.chat_requests == 2
+
+def test_retries_stop_after_max_retries(stub_url, monkeypatch):
+    monkeypatch.setattr(StubOpenAIHandler, "fail_next", 10)
+    engine = AsyncQAEngine(max_retries=2, backoff=0.01)
+    with pytest.raises(Exception):
+        engine.submit(engine.agenerate([HumanMessage(content="Bonjour")])).result(timeout=10)
+    assert StubOpenAIHandler.chat_requests == 3
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+pytest.importorskip("langchain_community")
+pytest.importorskip("faiss")
+
+import data_processor
+from batch_qa import load_answers, run_batch
+
+@pytest.fixture
+def indexed_course(tmp_path):
+    course = tmp_path / "cours.txt"
+    course.write_text("Le protocole DHCP attribue automatiquement une adresse IP aux postes.", encoding="utf-8")
+    data_processor.ingest_files([str(course)], index_dir=data_processor.INDEX_DIR)
+    yield
+    data_processor.clear_index(data_processor.INDEX_DIR)
+
+def test_rerun_resumes_after_a_truncated_line(tmp_path, indexed_course):
+    output = tmp_path / "faq.jsonl"
+    questions = ["C'est quoi DHCP ?", "À quoi sert une adresse IP ?"]
+    assert run_batch(questions, str(output))["answered"] == 2
+
+    # Arrêt brutal pendant l'écriture d'une réponse
+    with open(output, "a", encoding="utf-8") as f:
+        f.write('{"question": "trunc')
+    stats = run_batch(questions + ["Qu'est-ce qu'un bail DHCP ?"], str(output))
+    assert stats["answered"] == 1 and stats["skipped"] == 2
+
+    lines = output.read_text(encoding="utf-8").splitlines()
+    # Réponses écrites dans leur ordre d'arrivée
+    assert sorted(json.loads(line)["question"] for line in lines) == sorted(questions + ["Qu'est-ce qu'un bail DHCP ?"])
+    assert len(load_answers(str(output))) == 3
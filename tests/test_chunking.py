@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+from langchain.schema.document import Document
+
+from chunking import chunk_documents, strip_repeated_lines
+
+def _pdf_pages(texts: list) -> list:
+    return [
+        Document(page_content=text, metadata={"source": "exercices.pdf", "page": i})
+        for i, text in enumerate(texts)
+    ]
+
+def test_short_pages_keep_their_content():
+    # Énoncés courts qui ne diffèrent que par leurs nombres : rien n'est un en-tête
+    pages = _pdf_pages([f"Exercice\nCalculez le masque pour {10 * (i + 1)} hôtes sur le réseau {i}" for i in range(6)])
+    assert strip_repeated_lines(pages) == pages
+    chunks = chunk_documents(pages)
+    assert chunks
+    assert all(f"réseau {i}" in " ".join(c.page_content for c in chunks) for i in range(6))
+
+def test_repeated_header_and_page_number_are_removed():
+    body = "\n".join(f"Ligne {j} du cours sur le routage, page {{page}}" for j in range(10))
+    pages = _pdf_pages([
+        f"Université - Réseaux L2\n{body.format(page=i)}\nPage {i + 1} / 5" for i in range(5)
+    ])
+    cleaned = strip_repeated_lines(pages)
+    for page in cleaned:
+        assert "Université - Réseaux L2" not in page.page_content
+        assert "/ 5" not in page.page_content
+        assert "Ligne 0 du cours" in page.page_content
+
+def test_long_markdown_section_has_no_heading_only_chunk():
+    paragraph = " ".join(f"Le routeur {i} transmet les paquets vers la passerelle." for i in range(60))
+    text = f"# A\n\n## B\n\n{paragraph}\n\n{paragraph}"
+    chunks = chunk_documents([Document(page_content=text, metadata={"source": "cours.md"})], chunk_tokens=120)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.page_content.startswith("A > B\n")
+        assert len(chunk.page_content) > len("A > B\n") + 20
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("langchain_community")
+pytest.importorskip("faiss")
+
+from data_processor import current_index_path, ingest_files, load_manifest, load_snapshot, remove_document
+from embeddings import get_embeddings
+
+COURSE = "\n\n".join(
+    f"Section {i}. Le protocole DHCP attribue une adresse IP au poste {i} du réseau local." for i in range(20)
+)
+
+def _indexed_ids(index_dir: str):
+    _, snapshot_path = current_index_path(index_dir)
+    manifest = load_manifest(snapshot_path)
+    manifest_ids = {c["id"] for entry in manifest["documents"].values() for c in entry["chunks"]}
+    db = load_snapshot(snapshot_path, get_embeddings())
+    return manifest, manifest_ids, set(db.index_to_docstore_id.values())
+
+def test_ingest_reingest_and_remove_keep_manifest_and_index_in_sync(tmp_path):
+    index_dir = str(tmp_path / "index")
+    a, b = tmp_path / "a.txt", tmp_path / "b.txt"
+    a.write_text(COURSE, encoding="utf-8")
+    b.write_text(COURSE.replace("DHCP", "APIPA"), encoding="utf-8")
+
+    progress = []
+    db = ingest_files([str(a), str(b)], index_dir=index_dir,
+                      progress_callback=lambda path, n, done, total, error: progress.append((path, error)))
+    assert db.index.ntotal > 0
+    assert sorted(progress) == [(str(a), None), (str(b), None)]
+    manifest, manifest_ids, indexed_ids = _indexed_ids(index_dir)
+    assert len(manifest["documents"]) == 2
+    assert manifest_ids == indexed_ids
+
+    # Fichier inchangé : rien à écrire
+    assert ingest_files([str(a)], index_dir=index_dir) is None
+
+    # Fichier modifié : ses chunks disparus sont supprimés, les nouveaux ajoutés
+    a.write_text(COURSE.replace("Section 3.", "Section trois, revue."), encoding="utf-8")
+    assert ingest_files([str(a)], index_dir=index_dir) is not None
+    _, manifest_ids, indexed_ids = _indexed_ids(index_dir)
+    assert manifest_ids == indexed_ids
+
+    assert remove_document(str(b), index_dir)
+    manifest, manifest_ids, indexed_ids = _indexed_ids(index_dir)
+    assert list(manifest["documents"]) == [str(a)]
+    assert manifest_ids == indexed_ids
+    assert not remove_document(str(b), index_dir)
@@ -0,0 +1,39 @@
+import pytest
+
+import job_queue
+from job_queue import JOB_INGEST, claim_next_job, commit_files, enqueue, finish_job, list_jobs, update_file
+
+@pytest.fixture(autouse=True)
+def jobs_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOBS_DB_PATH", str(tmp_path / "jobs.sqlite"))
+
+def _statuses(job_id: int) -> dict:
+    job, = [job for job in list_jobs(limit=10) if job["id"] == job_id]
+    return job["status"], {f["path"]: f["status"] for f in job["files"]}
+
+def test_parsed_files_fail_with_the_job():
+    job_id = enqueue(JOB_INGEST, ["a.pdf", "b.pdf"], "index")
+    assert claim_next_job(1)["id"] == job_id
+    update_file(job_id, "a.pdf", "parsed", 3)
+    # Échec de l'embedding ou de la sauvegarde : a.pdf n'est jamais arrivé dans l'index
+    finish_job(job_id, error="APIConnectionError")
+    assert _statuses(job_id) == ("failed", {"a.pdf": "failed", "b.pdf": "failed"})
+
+def test_files_are_done_only_after_commit():
+    job_id = enqueue(JOB_INGEST, ["a.pdf"], "index")
+    claim_next_job(1)
+    update_file(job_id, "a.pdf", "parsed", 3)
+    assert _statuses(job_id)[1] == {"a.pdf": "parsed"}
+    commit_files(job_id)
+    assert finish_job(job_id) == "done"
+    assert _statuses(job_id) == ("done", {"a.pdf": "done"})
+
+def test_missing_file_makes_the_job_partial():
+    job_id = enqueue(JOB_INGEST, ["a.pdf", "absent.pdf"], "index")
+    claim_next_job(1)
+    update_file(job_id, "a.pdf", "parsed", 3)
+    update_file(job_id, "absent.pdf", "failed", error="Fichier introuvable")
+    commit_files(job_id)
+    assert finish_job(job_id) == "partial"
+    job, = list_jobs(limit=1)
+    assert "absent.pdf" in job["error"]
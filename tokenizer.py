@@ -0,0 +1,22 @@
+import os
+
+# Encodage tiktoken utilisé pour compter les tokens (celui de gpt-4o par défaut)
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "o200k_base")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+except Exception:
+    # tiktoken absent ou fichier d'encodage indisponible hors ligne
+    print("⚠️ tiktoken indisponible, estimation du nombre de tokens (4 caractères ≈ 1 token).")
+    _encoding = None
+
+def count_tokens(text: str) -> int:
+    """Nombre de tokens d'un texte (estimation si tiktoken est indisponible)"""
+    if _encoding is None:
+        return (len(text) + 3) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+def count_message_tokens(messages: list) -> int:
+    """Nombre de tokens d'une liste de messages LangChain (4 tokens de surcoût par message)"""
+    return sum(count_tokens(message.content) + 4 for message in messages)
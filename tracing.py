@@ -0,0 +1,191 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Journal JSON d'une ligne par trace (stderr, et fichier si TRACE_LOG_FILE est défini)
+TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE")
+# Export Prometheus : fichier texte réécrit après chaque trace et/ou endpoint HTTP /metrics
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+_STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger("schoolify.trace")
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    if TRACE_LOG_FILE:
+        logger.addHandler(logging.FileHandler(TRACE_LOG_FILE, encoding="utf-8"))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_current = contextvars.ContextVar("schoolify_trace", default=None)
+_last = threading.local()
+_metrics_lock = threading.Lock()
+# (trace, étape) -> [compteurs par bucket, somme, nombre]
+_histograms = {}
+# (métrique, libellé) -> valeur
+_counters = {}
+
+class Trace:
+    """Durées par étape et attributs (tokens, cache...) d'une requête ou d'une ingestion"""
+
+    def __init__(self, name: str, start: float = None):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.stages = {}
+        self.attributes = {}
+        # `start` (time.perf_counter) : trace commencée avant que tracing soit importé
+        self._start = start if start is not None else time.perf_counter()
+        self.total_seconds = None
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name: str, seconds: float):
+        # Une étape répétée (ex. lots d'embedding) cumule ses durées
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def finish(self):
+        if self.total_seconds is not None:
+            return
+        self.total_seconds = time.perf_counter() - self._start
+        _last.trace = self
+        _observe(self)
+        logger.info(json.dumps(self.to_dict(), ensure_ascii=False, default=str))
+        if METRICS_FILE:
+            write_metrics_file(METRICS_FILE)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace": self.name,
+            "trace_id": self.trace_id,
+            "total_ms": round((self.total_seconds or 0.0) * 1000, 2),
+            "stages_ms": {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()},
+            **self.attributes,
+        }
+
+@contextmanager
+def trace(name: str, defer_finish: bool = False):
+    """Ouvre une trace courante ; avec `defer_finish`, l'appelant appelle finish() lui-même"""
+    current = Trace(name)
+    token = _current.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set("error", type(e).__name__)
+        current.finish()
+        raise
+    finally:
+        _current.reset(token)
+    if not defer_finish:
+        current.finish()
+
+@contextmanager
+def stage(name: str):
+    """Mesure une étape de la trace courante (sans effet hors trace)"""
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    with current.stage(name):
+        yield
+
+def record(key: str, value):
+    """Ajoute un attribut à la trace courante"""
+    current = _current.get()
+    if current is not None:
+        current.set(key, value)
+
+def increment(metric: str, label: str, value: float = 1.0):
+    """Incrémente un compteur Prometheus (ex. increment("cache", "answer_hit"))"""
+    with _metrics_lock:
+        _counters[(metric, label)] = _counters.get((metric, label), 0.0) + value
+
+def current_trace():
+    return _current.get()
+
+def last_trace():
+    """Dernière trace terminée dans ce thread (un thread par exécution de script Streamlit)"""
+    return getattr(_last, "trace", None)
+
+def _observe(finished: Trace):
+    with _metrics_lock:
+        for stage_name, seconds in list(finished.stages.items()) + [("total", finished.total_seconds)]:
+            histogram = _histograms.setdefault(
+                (finished.name, stage_name), [[0] * len(_STAGE_BUCKETS), 0.0, 0]
+            )
+            for i, bound in enumerate(_STAGE_BUCKETS):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+def render_prometheus() -> str:
+    """Métriques au format texte Prometheus"""
+    lines = [
+        "# HELP schoolify_stage_seconds Durée des étapes de la pipeline RAG.",
+        "# TYPE schoolify_stage_seconds histogram",
+    ]
+    with _metrics_lock:
+        for (trace_name, stage_name), (buckets, total, count) in sorted(_histograms.items()):
+            labels = f'trace="{trace_name}",stage="{stage_name}"'
+            for bound, bucket_count in zip(_STAGE_BUCKETS, buckets):
+                lines.append(f'schoolify_stage_seconds_bucket{{{labels},le="{bound}"}} {bucket_count}')
+            lines.append(f'schoolify_stage_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"schoolify_stage_seconds_sum{{{labels}}} {total}")
+            lines.append(f"schoolify_stage_seconds_count{{{labels}}} {count}")
+        for metric in sorted({metric for metric, _ in _counters}):
+            lines.append(f"# TYPE schoolify_{metric}_total counter")
+            for (name, label), value in sorted(_counters.items()):
+                if name == metric:
+                    lines.append(f'schoolify_{metric}_total{{kind="{label}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+def write_metrics_file(path: str):
+    """Écrit les métriques de façon atomique (compatible textfile collector de node_exporter)"""
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(path + ".tmp", path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port: int = METRICS_PORT):
+    """Démarre (une seule fois par process) l'endpoint /metrics si un port est configuré"""
+    global _server
+    if not port or _server is not None:
+        return
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+            print(f"📈 Métriques Prometheus sur http://0.0.0.0:{port}/metrics")
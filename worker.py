@@ -0,0 +1,118 @@
+"""Worker d'indexation : exécute les travaux de la file (job_queue) hors de Streamlit.
+
+    python worker.py            # tourne en continu
+    python worker.py --once     # vide la file puis s'arrête
+
+Un seul worker tourne à la fois (verrou fcntl) ; l'application en démarre un
+automatiquement si aucun n'est actif (INGEST_WORKER_AUTOSTART=0 pour le gérer soi-même).
+"""
+import argparse
+import fcntl
+import os
+import subprocess
+import sys
+import time
+
+from job_queue import (
+    JOB_INGEST, JOB_REMOVE, JOB_RESET, JOBS_DB_PATH,
+    claim_next_job, commit_files, finish_job, requeue_interrupted_jobs, update_file,
+)
+
+WORKER_LOCK_PATH = JOBS_DB_PATH + ".worker.lock"
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "1.0"))
+INGEST_WORKER_AUTOSTART = os.getenv("INGEST_WORKER_AUTOSTART", "1") == "1"
+WORKER_LOG_PATH = os.getenv("WORKER_LOG_PATH", os.path.join(os.path.dirname(JOBS_DB_PATH) or ".", "worker.log"))
+
+def _try_lock(path: str):
+    """Verrou exclusif non bloquant, retourne le fichier verrouillé ou None"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def worker_running() -> bool:
+    lock_file = _try_lock(WORKER_LOCK_PATH)
+    if lock_file is None:
+        return True
+    lock_file.close()
+    return False
+
+def ensure_worker_running():
+    """Démarre un worker détaché s'il n'y en a aucun (appelé par l'application)"""
+    if not INGEST_WORKER_AUTOSTART or worker_running():
+        return
+    with open(WORKER_LOG_PATH, "a") as log:
+        subprocess.Popen(
+            [sys.executable, "-u", os.path.abspath(__file__)],
+            stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+            cwd=os.getcwd(),
+        )
+    print(f"👷 Worker d'indexation démarré (journal : {WORKER_LOG_PATH})")
+
+def run_job(job: dict):
+    # Import tardif : data_processor charge embeddings, FAISS, loaders...
+    from data_processor import clear_index, ingest_files, remove_document
+
+    job_id = job["id"]
+    print(f"🚧 Travail #{job_id} ({job['kind']}) : {len(job['files'])} fichier(s)")
+
+    def report_progress(path, n_chunks, done, total, error):
+        # "parsed" : analysé, pas encore dans l'index (devient "done" après la sauvegarde)
+        update_file(job_id, path, "failed" if error else "parsed", n_chunks,
+                    str(error) if error else None)
+
+    if job["kind"] == JOB_INGEST:
+        paths = [path for path in job["files"] if os.path.exists(path)]
+        for path in set(job["files"]) - set(paths):
+            update_file(job_id, path, "failed", error="Fichier introuvable")
+        ingest_files(paths, progress_callback=report_progress, index_dir=job["index_dir"])
+        commit_files(job_id)
+    elif job["kind"] == JOB_REMOVE:
+        for path in job["files"]:
+            remove_document(path, job["index_dir"])
+            if os.path.exists(path):
+                os.remove(path)
+            update_file(job_id, path, "done")
+    elif job["kind"] == JOB_RESET:
+        clear_index(job["index_dir"])
+    else:
+        raise ValueError(f"Type de travail inconnu : {job['kind']}")
+
+def run_worker(once: bool = False, poll_seconds: float = WORKER_POLL_SECONDS):
+    lock_file = _try_lock(WORKER_LOCK_PATH)
+    if lock_file is None:
+        print("⚠️ Un worker d'indexation tourne déjà.")
+        return
+    try:
+        # Seul worker actif : tout travail encore "running" a été interrompu
+        requeue_interrupted_jobs()
+        print("👷 Worker d'indexation prêt.")
+        while True:
+            job = claim_next_job(os.getpid())
+            if job is None:
+                if once:
+                    return
+                time.sleep(poll_seconds)
+                continue
+            try:
+                run_job(job)
+            except Exception as e:
+                print(f"❌ Travail #{job['id']} en échec : {e}")
+                finish_job(job["id"], error=str(e))
+            else:
+                if finish_job(job["id"]) == "partial":
+                    print(f"⚠️ Travail #{job['id']} terminé avec des fichiers en échec.")
+                else:
+                    print(f"✅ Travail #{job['id']} terminé.")
+    finally:
+        lock_file.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker d'indexation des documents")
+    parser.add_argument("--once", action="store_true", help="Vide la file puis s'arrête")
+    args = parser.parse_args()
+    run_worker(once=args.once)